@@ -1,8 +1,291 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
 from kra import models
+from kra.analytics import sketch
+
+# aggregates are advanced only by samples older than this, so that samples written with scrape and write lag
+# don't get behind the watermark, later samples (e.g. replayed from collector spool) reset the aggregate,
+# see reset_containers_summary
+SETTLE_DELAY = timedelta(minutes=5)
+
+# advisory lock, which serializes advancing and resetting of aggregates
+ADVANCE_LOCK_ID = 0x6b7261
+
+SUMMARY_FIELDS = [
+    f.name for f in models.ContainerSummary._meta.concrete_fields if f.name not in ('id', 'container', 'frozen')
+]
+
+
+def summarize_containers(container_ids=None):
+    """
+    Same stats as get_containers_summary, read from running aggregates (ContainerSummary),
+    which are advanced first. Reads O(containers) rows and only samples newer than aggregate watermarks.
+    Aggregates of containers started before retention are rebuilt by cleanup from retained samples,
+    so that they cover the same samples as get_containers_summary (up to samples deleted since last cleanup).
+    :return: list of containers with summary attributes
+    """
+    advance_containers_summary(container_ids)
+
+    result = []
+    summary_qs = models.ContainerSummary.objects.select_related('container')
+    if container_ids is not None:
+        summary_qs = summary_qs.filter(container_id__in=container_ids)
+    for summary in summary_qs:
+        container = summary.container
+        for name in SUMMARY_FIELDS:
+            setattr(container, name, getattr(summary, name))
+        result.append(container)
+    return result
+
+
+def advance_containers_summary(container_ids=None):
+    """
+    Adds samples newer than watermark (ContainerSummary.till) to running aggregates of containers.
+    First sample after watermark is weighted by time since watermark, and its cpu rate is derived from
+    last_cpu_m_seconds, so the result is the same as of full scan by get_containers_summary.
+    Aggregates of containers finished before SETTLE_DELAY are frozen (not advanced anymore) once they are advanced
+    by all settled samples. Settled samples written later (e.g. replayed from collector spool) reset the frozen
+    aggregate, no matter if they are behind its watermark, so that they are aggregated on rebuild.
+    Samples written behind the watermark reset the aggregate, which is then recomputed (see reset_containers_summary).
+    Time-weighted quantile sketches of memory and cpu (see kra.analytics.sketch) are advanced as well.
+    :return: number of advanced containers
+    """
+    if container_ids is not None:
+        if not container_ids:
+            return 0
+        container_ids_str = ','.join(str(cid) for cid in container_ids)
+        container_filter = f'AND c.id IN ({container_ids_str})'
+    else:
+        container_filter = ''
+
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [ADVANCE_LOCK_ID])
+        cursor.execute(r"""
+        INSERT INTO %(summary_tblname)s (
+            container_id, since, till, last_cpu_m_seconds, total_seconds, weight_seconds,
+            max_memory_mi, avg_memory_mi, stddev_memory_mi, total_memory_mi_seconds, total_memory_mi2_seconds,
+            max_cpu_m, avg_cpu_m, stddev_cpu_m, total_cpu_m_seconds, weighted_cpu_m_seconds, total_cpu_m2_seconds,
+            memory_sketch, cpu_sketch, frozen
+        )
+        SELECT
+            container_id, since, till, last_cpu_m_seconds, total_seconds, weight_seconds,
+            max_memory_mi, avg_memory_mi,
+            sqrt(greatest(
+                total_memory_mi2_seconds
+                - 2 * avg_memory_mi * total_memory_mi_seconds
+                + avg_memory_mi ^ 2 * weight_seconds,
+                0
+            ) / total_seconds) AS stddev_memory_mi,
+            total_memory_mi_seconds, total_memory_mi2_seconds,
+            max_cpu_m, avg_cpu_m,
+            sqrt(greatest(
+                total_cpu_m2_seconds
+                - 2 * avg_cpu_m * weighted_cpu_m_seconds
+                + avg_cpu_m ^ 2 * weight_seconds,
+                0
+            ) / total_seconds) AS stddev_cpu_m,
+            total_cpu_m_seconds, weighted_cpu_m_seconds, total_cpu_m2_seconds,
+            memory_sketch, cpu_sketch, FALSE
+        FROM (
+            SELECT
+                *,
+                (total_memory_mi_seconds / total_seconds) AS avg_memory_mi,
+                (total_cpu_m_seconds / total_seconds) AS avg_cpu_m
+            FROM (
+                SELECT
+                    *,
+                    extract(epoch FROM (till - since)) AS total_seconds
+                FROM (
+                    SELECT
+                        c.id AS container_id,
+                        c.started_at AS since,
+                        n.till,
+                        n.last_cpu_m_seconds,
+                        n.memory_sketch,
+                        n.cpu_sketch,
+                        greatest(s.max_memory_mi, n.max_memory_mi) AS max_memory_mi,
+                        greatest(s.max_cpu_m, n.max_cpu_m) AS max_cpu_m,
+                        greatest(s.total_cpu_m_seconds, n.total_cpu_m_seconds) AS total_cpu_m_seconds,
+                        coalesce(s.weight_seconds, 0) + n.weight_seconds AS weight_seconds,
+                        coalesce(s.total_memory_mi_seconds, 0) + n.total_memory_mi_seconds
+                            AS total_memory_mi_seconds,
+                        coalesce(s.total_memory_mi2_seconds, 0) + n.total_memory_mi2_seconds
+                            AS total_memory_mi2_seconds,
+                        coalesce(s.weighted_cpu_m_seconds, 0) + coalesce(n.weighted_cpu_m_seconds, 0)
+                            AS weighted_cpu_m_seconds,
+                        coalesce(s.total_cpu_m2_seconds, 0) + coalesce(n.total_cpu_m2_seconds, 0)
+                            AS total_cpu_m2_seconds
+                    FROM %(container_tblname)s AS c
+                    LEFT JOIN %(summary_tblname)s AS s ON s.container_id = c.id
+                    JOIN LATERAL (
+                        WITH samples AS (
+                            SELECT
+                                *,
+                                delta_cpu_m_seconds / NULLIF(delta_seconds, 0) AS cpu_m
+                            FROM (
+                                SELECT
+                                    measured_at,
+                                    cpu_m_seconds,
+                                    memory_mi,
+                                    extract(epoch FROM (
+                                        measured_at - coalesce(lag(measured_at) OVER w, s.till, c.started_at)
+                                    )) AS delta_seconds,
+                                    cpu_m_seconds - coalesce(lag(cpu_m_seconds) OVER w, s.last_cpu_m_seconds, 0)
+                                        AS delta_cpu_m_seconds
+                                FROM %(ru_tblname)s
+                                WHERE container_id = c.id
+                                    AND measured_at > coalesce(s.till, '-infinity')
+                                    AND measured_at <= %%(settled_before)s
+                                WINDOW w AS (ORDER BY measured_at)
+                            ) AS q0
+                        )
+                        SELECT
+                            max(measured_at) AS till,
+                            (array_agg(cpu_m_seconds ORDER BY measured_at DESC))[1] AS last_cpu_m_seconds,
+                            max(cpu_m) AS max_cpu_m,
+                            max(cpu_m_seconds) AS total_cpu_m_seconds,
+                            max(memory_mi) AS max_memory_mi,
+                            sum(delta_seconds) AS weight_seconds,
+                            sum(memory_mi * delta_seconds) AS total_memory_mi_seconds,
+                            sum(memory_mi ^ 2 * delta_seconds) AS total_memory_mi2_seconds,
+                            sum(delta_cpu_m_seconds) FILTER (WHERE cpu_m IS NOT NULL) AS weighted_cpu_m_seconds,
+                            sum(delta_cpu_m_seconds * cpu_m) AS total_cpu_m2_seconds,
+                            (
+                                SELECT coalesce(jsonb_object_agg(bucket, weight_seconds), '{}')
+                                FROM (
+                                    SELECT bucket, sum(weight_seconds) AS weight_seconds
+                                    FROM (
+                                        SELECT key AS bucket, value::float AS weight_seconds
+                                        FROM jsonb_each_text(s.memory_sketch)
+                                        UNION ALL
+                                        SELECT %(memory_bucket)s::text, delta_seconds
+                                        FROM samples
+                                        WHERE delta_seconds > 0
+                                    ) AS b0
+                                    GROUP BY bucket
+                                ) AS b1
+                            ) AS memory_sketch,
+                            (
+                                SELECT coalesce(jsonb_object_agg(bucket, weight_seconds), '{}')
+                                FROM (
+                                    SELECT bucket, sum(weight_seconds) AS weight_seconds
+                                    FROM (
+                                        SELECT key AS bucket, value::float AS weight_seconds
+                                        FROM jsonb_each_text(s.cpu_sketch)
+                                        UNION ALL
+                                        SELECT %(cpu_bucket)s::text, delta_seconds
+                                        FROM samples
+                                        WHERE cpu_m IS NOT NULL AND delta_seconds > 0
+                                    ) AS b0
+                                    GROUP BY bucket
+                                ) AS b1
+                            ) AS cpu_sketch
+                        FROM samples
+                    ) AS n ON n.till IS NOT NULL
+                    WHERE (s.id IS NULL OR NOT s.frozen)
+                        %(container_filter)s
+                ) AS q2
+            ) AS q3
+            WHERE total_seconds > 0
+        ) AS q4
+        ON CONFLICT (container_id) DO UPDATE SET
+            till = EXCLUDED.till,
+            last_cpu_m_seconds = EXCLUDED.last_cpu_m_seconds,
+            total_seconds = EXCLUDED.total_seconds,
+            weight_seconds = EXCLUDED.weight_seconds,
+            max_memory_mi = EXCLUDED.max_memory_mi,
+            avg_memory_mi = EXCLUDED.avg_memory_mi,
+            stddev_memory_mi = EXCLUDED.stddev_memory_mi,
+            total_memory_mi_seconds = EXCLUDED.total_memory_mi_seconds,
+            total_memory_mi2_seconds = EXCLUDED.total_memory_mi2_seconds,
+            max_cpu_m = EXCLUDED.max_cpu_m,
+            avg_cpu_m = EXCLUDED.avg_cpu_m,
+            stddev_cpu_m = EXCLUDED.stddev_cpu_m,
+            total_cpu_m_seconds = EXCLUDED.total_cpu_m_seconds,
+            weighted_cpu_m_seconds = EXCLUDED.weighted_cpu_m_seconds,
+            total_cpu_m2_seconds = EXCLUDED.total_cpu_m2_seconds,
+            memory_sketch = EXCLUDED.memory_sketch,
+            cpu_sketch = EXCLUDED.cpu_sketch
+        """ % {
+            'container_tblname': models.Container._meta.db_table,
+            'summary_tblname': models.ContainerSummary._meta.db_table,
+            'ru_tblname': models.ResourceUsage._meta.db_table,
+            'container_filter': container_filter,
+            'memory_bucket': sketch.bucket_sql('memory_mi'),
+            'cpu_bucket': sketch.bucket_sql('cpu_m'),
+        }, {
+            'settled_before': now - SETTLE_DELAY,
+        })
+        count = cursor.rowcount
+
+        # all settled samples are aggregated above, samples committed meanwhile reset aggregates after the lock
+        cursor.execute(r"""
+        UPDATE %(summary_tblname)s AS s
+        SET frozen = TRUE
+        FROM %(container_tblname)s AS c
+        WHERE c.id = s.container_id
+            AND NOT s.frozen
+            AND c.finished_at <= %%(settled_before)s
+            %(container_filter)s
+        """ % {
+            'container_tblname': models.Container._meta.db_table,
+            'summary_tblname': models.ContainerSummary._meta.db_table,
+            'container_filter': container_filter,
+        }, {
+            'settled_before': now - SETTLE_DELAY,
+        })
+        return count
+
+
+def reset_containers_summary(rows):
+    """
+    Deletes running aggregates of containers, which are advanced past written samples or frozen,
+    so that they are recomputed from scratch by advance_containers_summary.
+    Should be called after samples are written. Samples newer than SETTLE_DELAY can't be behind watermarks,
+    so nothing is queried for them.
+    :param rows: iterable of ResourceUsage rows (container_id, measured_at, ...)
+    :return: number of deleted aggregates
+    """
+    settled_before = timezone.now() - SETTLE_DELAY
+    earliest = {}
+    for container_id, measured_at, *_ in rows:
+        if measured_at <= settled_before and measured_at < earliest.get(container_id, settled_before):
+            earliest[container_id] = measured_at
+    if not earliest:
+        return 0
+
+    # lock, so that aggregate being advanced concurrently without the samples is not kept
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [ADVANCE_LOCK_ID])
+        cursor.execute(r"""
+        DELETE FROM %(summary_tblname)s AS s
+        USING unnest(%%(container_ids)s::bigint[], %%(measured_ats)s::timestamptz[]) AS r(container_id, measured_at)
+        WHERE s.container_id = r.container_id AND (s.frozen OR s.till >= r.measured_at)
+        """ % {
+            'summary_tblname': models.ContainerSummary._meta.db_table,
+        }, {
+            'container_ids': list(earliest.keys()),
+            'measured_ats': list(earliest.values()),
+        })
+        return cursor.rowcount
 
 
 def get_containers_summary(container_ids=None):
+    """
+    Time-weighted stats of container resource usage. Each sample is weighted by time since the previous one
+    (or since container start), cpu rate is derived from the cumulative counter.
+    Reference for running aggregates of summarize_containers, which are checked against it by check_summaries command.
+
+    Resource usage is scanned once: weighted sums Σw·x and Σw·x² are accumulated in a single pass,
+    and stddev is sqrt(Σw·(x - avg)² / total_seconds) = sqrt((Σw·x² - 2·avg·Σw·x + avg²·Σw) / total_seconds).
+    """
     if container_ids is not None:
+        if not container_ids:
+            return []
         container_ids_str = ','.join(str(cid) for cid in container_ids)
         container_filter = f'AND id IN ({container_ids_str})'
     else:
@@ -13,15 +296,35 @@ def get_containers_summary(container_ids=None):
         *
     FROM %(container_tblname)s AS c
     LEFT JOIN LATERAL (
-        SELECT * FROM (
+        SELECT
+            since,
+            till,
+            total_seconds,
+            weight_seconds,
+            total_cpu_m_seconds,
+            weighted_cpu_m_seconds,
+            max_memory_mi,
+            max_cpu_m,
+            total_memory_mi_seconds,
+            total_memory_mi2_seconds,
+            total_cpu_m2_seconds,
+            avg_memory_mi,
+            avg_cpu_m,
+            sqrt(greatest(
+                total_memory_mi2_seconds
+                - 2 * avg_memory_mi * total_memory_mi_seconds
+                + avg_memory_mi ^ 2 * weight_seconds,
+                0
+            ) / total_seconds) AS stddev_memory_mi,
+            sqrt(greatest(
+                total_cpu_m2_seconds
+                - 2 * avg_cpu_m * weighted_cpu_m_seconds
+                + avg_cpu_m ^ 2 * weight_seconds,
+                0
+            ) / total_seconds) AS stddev_cpu_m
+        FROM (
             SELECT
-                since,
-                till,
-                total_seconds,
-                total_cpu_m_seconds,
-                max_memory_mi,
-                max_cpu_m,
-                total_memory_mi_seconds,
+                *,
                 (total_memory_mi_seconds / total_seconds) AS avg_memory_mi,
                 (total_cpu_m_seconds / total_seconds) AS avg_cpu_m
             FROM (
@@ -35,76 +338,33 @@ def get_containers_summary(container_ids=None):
                         max(cpu_m) AS max_cpu_m,
                         max(cpu_m_seconds) AS total_cpu_m_seconds,
                         max(memory_mi) AS max_memory_mi,
-                        sum(delta_memory_mi_seconds) AS total_memory_mi_seconds
+                        sum(delta_seconds) AS weight_seconds,
+                        sum(memory_mi * delta_seconds) AS total_memory_mi_seconds,
+                        sum(memory_mi ^ 2 * delta_seconds) AS total_memory_mi2_seconds,
+                        sum(delta_cpu_m_seconds) FILTER (WHERE cpu_m IS NOT NULL) AS weighted_cpu_m_seconds,
+                        sum(delta_cpu_m_seconds * cpu_m) AS total_cpu_m2_seconds
                     FROM (
                         SELECT
                             *,
-                            memory_mi * delta_seconds AS delta_memory_mi_seconds,
-                            delta_cpu_m_seconds / delta_seconds AS cpu_m
+                            delta_cpu_m_seconds / NULLIF(delta_seconds, 0) AS cpu_m
                         FROM (
                             SELECT
                                 measured_at,
                                 cpu_m_seconds,
                                 memory_mi,
-                                (
-                                    CASE
-                                        WHEN lag(measured_at) OVER w IS NOT NULL
-                                            THEN extract(epoch FROM (measured_at - lag(measured_at) OVER w))
-                                            ELSE extract(epoch FROM (measured_at - c.started_at))
-                                    END
-                                ) AS delta_seconds,
-                                (
-                                    CASE
-                                        WHEN lag(cpu_m_seconds) OVER w IS NOT NULL
-                                            THEN cpu_m_seconds - lag(cpu_m_seconds) OVER w
-                                            ELSE cpu_m_seconds
-                                    END
-                                ) AS delta_cpu_m_seconds
+                                extract(epoch FROM (
+                                    measured_at - coalesce(lag(measured_at) OVER w, c.started_at)
+                                )) AS delta_seconds,
+                                cpu_m_seconds - coalesce(lag(cpu_m_seconds) OVER w, 0) AS delta_cpu_m_seconds
                             FROM %(ru_tblname)s
                             WHERE container_id = c.id
                             WINDOW w AS (ORDER BY measured_at)
-                        ) AS pass1q0
-                    ) AS pass1q1
-                ) AS pass1q2
-            ) AS pass1q3
-        ) AS pass1
-        LEFT JOIN LATERAL (
-            SELECT
-                sqrt(total_stddev_memory_mi2_seconds / total_seconds) AS stddev_memory_mi,
-                sqrt(total_stddev_cpu_m2_seconds / total_seconds) AS stddev_cpu_m
-            FROM (
-                SELECT
-                    sum(stddev_memory_mi2_seconds) AS total_stddev_memory_mi2_seconds,
-                    sum(stddev_cpu_m2_seconds) AS total_stddev_cpu_m2_seconds
-                FROM (
-                    SELECT
-                        ((memory_mi - avg_memory_mi)^2 * delta_seconds) AS stddev_memory_mi2_seconds,
-                        ((delta_cpu_m_seconds / delta_seconds - avg_cpu_m)^2 * delta_seconds) AS stddev_cpu_m2_seconds
-                    FROM (
-                        SELECT
-                            cpu_m_seconds,
-                            memory_mi,
-                            (
-                                CASE
-                                    WHEN lag(measured_at) OVER w IS NOT NULL
-                                        THEN extract(epoch FROM (measured_at - lag(measured_at) OVER w))
-                                        ELSE extract(epoch FROM (measured_at - c.started_at))
-                                END
-                            ) AS delta_seconds,
-                            (
-                                CASE
-                                    WHEN lag(cpu_m_seconds) OVER w IS NOT NULL
-                                        THEN cpu_m_seconds - lag(cpu_m_seconds) OVER w
-                                        ELSE cpu_m_seconds
-                                END
-                            ) AS delta_cpu_m_seconds
-                        FROM %(ru_tblname)s
-                        WHERE container_id = c.id
-                        WINDOW w AS (ORDER BY measured_at)
-                    ) AS pass2q0
-                ) AS pass2q1
-            ) AS pass2q2
-        ) AS pass2 ON TRUE
+                        ) AS q0
+                    ) AS q1
+                ) AS q2
+            ) AS q3
+            WHERE total_seconds > 0
+        ) AS q4
     ) AS summary ON TRUE
     WHERE total_seconds IS NOT NULL %(container_filter)s
     """ % {
@@ -0,0 +1,83 @@
+"""
+Mergeable time-weighted moments of resource usage.
+
+ContainerSummary, InstanceSummary and Summary keep sums (Σw, Σw·x, Σw·x²), maxima, quantile sketches
+(see kra.analytics.sketch) and since/till, instead of only avg and stddev, so that stats of any set of them
+(e.g. of workload or of time window) are computed exactly by adding the sums, without touching resource usage samples.
+
+total_seconds of merged state is the sum of merged durations, not till - since.
+"""
+
+import math
+
+from kra.analytics import sketch
+
+MOMENT_FIELDS = (
+    'total_seconds',
+    'weight_seconds',
+    'total_memory_mi_seconds',
+    'total_memory_mi2_seconds',
+    'total_cpu_m_seconds',
+    'weighted_cpu_m_seconds',
+    'total_cpu_m2_seconds',
+)
+
+
+def merge_moments(target, sources):
+    """
+    Sets mergeable state of target to the merge of sources, and fills max, avg and stddev of target from it.
+    Sketches are merged too, but quantiles are not filled (see kra.analytics.sketch.fill_quantiles).
+    """
+    for name in MOMENT_FIELDS:
+        setattr(target, name, 0)
+    target.since = None
+    target.till = None
+    target.max_memory_mi = 0
+    target.max_cpu_m = 0
+    memory_sketches = []
+    cpu_sketches = []
+
+    for s in sources:
+        for name in MOMENT_FIELDS:
+            setattr(target, name, getattr(target, name) + getattr(s, name))
+        if s.since is not None and (target.since is None or s.since < target.since):
+            target.since = s.since
+        if s.till is not None and (target.till is None or s.till > target.till):
+            target.till = s.till
+        target.max_memory_mi = max(target.max_memory_mi, s.max_memory_mi)
+        target.max_cpu_m = max(target.max_cpu_m, s.max_cpu_m)
+        memory_sketches.append(s.memory_sketch)
+        cpu_sketches.append(s.cpu_sketch)
+
+    target.memory_sketch = sketch.merge_sketches(memory_sketches)
+    target.cpu_sketch = sketch.merge_sketches(cpu_sketches)
+    fill_stats(target)
+
+
+def fill_stats(target):
+    """
+    Fills avg and stddev of target from its mergeable state.
+    stddev is sqrt(Σw·(x - avg)² / total_seconds) = sqrt((Σw·x² - 2·avg·Σw·x + avg²·Σw) / total_seconds),
+    the same as of get_containers_summary.
+    """
+    if not target.total_seconds:
+        target.avg_memory_mi = target.stddev_memory_mi = 0
+        target.avg_cpu_m = target.stddev_cpu_m = 0
+        return
+
+    avg_memory_mi = target.total_memory_mi_seconds / target.total_seconds
+    avg_cpu_m = target.total_cpu_m_seconds / target.total_seconds
+    target.avg_memory_mi = round(avg_memory_mi)
+    target.avg_cpu_m = round(avg_cpu_m)
+    target.stddev_memory_mi = round(_stddev(
+        avg_memory_mi, target.weight_seconds, target.total_memory_mi_seconds, target.total_memory_mi2_seconds,
+        target.total_seconds,
+    ))
+    target.stddev_cpu_m = round(_stddev(
+        avg_cpu_m, target.weight_seconds, target.weighted_cpu_m_seconds, target.total_cpu_m2_seconds,
+        target.total_seconds,
+    ))
+
+
+def _stddev(avg, weight_sum, weighted_sum, weighted_square_sum, total_seconds):
+    return math.sqrt(max(weighted_square_sum - 2 * avg * weighted_sum + avg ** 2 * weight_sum, 0) / total_seconds)
@@ -0,0 +1,65 @@
+"""
+Mergeable quantile sketches of resource usage, like DDSketch.
+
+Sketch is a dict of time weights (seconds) by bucket index, stored as JSON. Bucket i holds values
+in (GAMMA^(i-1), GAMMA^i], so any quantile is estimated with RELATIVE_ACCURACY, and sketches are merged
+by adding weights of the same buckets. Values below MIN_VALUE (1 Mi, 1m) are counted as MIN_VALUE.
+
+Sketches are built by advance_containers_summary (see kra.analytics.container) with bucket_sql,
+and merged to InstanceSummary and Summary with merge_moments (see kra.analytics.moments).
+"""
+
+import math
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_VALUE = 1
+
+QUANTILES = (50, 90, 95, 99)
+
+_LOG_GAMMA = math.log(GAMMA)
+
+
+def bucket_sql(expr):
+    """
+    :return: SQL expression of bucket index of value of `expr`
+    """
+    return f'ceil(ln(greatest({expr}, {MIN_VALUE})) / {_LOG_GAMMA!r})::integer'
+
+
+def merge_sketches(sketches):
+    merged = {}
+    for sketch in sketches:
+        for bucket, weight in sketch.items():
+            merged[bucket] = merged.get(bucket, 0) + weight
+    return merged
+
+
+def fill_quantiles(target):
+    """
+    Fills p50_memory_mi, p50_cpu_m, etc. of target from its sketches, None for empty sketch.
+    """
+    for q in QUANTILES:
+        for name, sketch in (('memory_mi', target.memory_sketch), ('cpu_m', target.cpu_sketch)):
+            value = get_quantile(sketch, q)
+            setattr(target, f'p{q}_{name}', value if value is None else round(value))
+
+
+def get_quantile(sketch, q):
+    """
+    :param q: quantile in percents
+    :return: estimated value or None for empty sketch
+    """
+    buckets = sorted((int(bucket), weight) for bucket, weight in sketch.items())
+    total_weight = sum(weight for _, weight in buckets)
+    if not total_weight:
+        return None
+
+    rank = total_weight * q / 100
+    cumulative_weight = 0
+    for bucket, weight in buckets:
+        cumulative_weight += weight
+        if cumulative_weight >= rank:
+            break
+    # middle of bucket with respect to relative error
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
@@ -0,0 +1,48 @@
+from django.db import connection
+
+
+def upsert(model, rows, conflict_fields, update_fields, returning=('id',), batch_size=1000):
+    """
+    INSERT ... ON CONFLICT (conflict_fields) DO UPDATE SET update_fields, with many rows per statement.
+    Rows are dicts by field attname (e.g. "pod_id"), missing fields get their defaults.
+    Rows of one call must not conflict with each other.
+    :return: list of tuples of `returning` field values, in no particular order
+    """
+    meta = model._meta
+    fields = [f for f in meta.concrete_fields if not f.primary_key]
+    qn = connection.ops.quote_name
+
+    columns = ', '.join(qn(f.column) for f in fields)
+    conflict = ', '.join(qn(meta.get_field(name).column) for name in conflict_fields)
+    update = ', '.join(f'{qn(c)} = EXCLUDED.{qn(c)}' for c in (meta.get_field(name).column for name in update_fields))
+    ret = ', '.join(qn(meta.get_field(name).column) for name in returning)
+    row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+
+    result = []
+    with connection.cursor() as c:
+        for batch in _batches(rows, batch_size):
+            params = []
+            for row in batch:
+                for f in fields:
+                    value = row[f.attname] if f.attname in row else (f.get_default() if f.has_default() else None)
+                    params.append(f.get_db_prep_save(value, connection))
+            c.execute(f'INSERT INTO {qn(meta.db_table)} ({columns}) VALUES {", ".join([row_sql] * len(batch))} '
+                      f'ON CONFLICT ({conflict}) DO UPDATE SET {update} RETURNING {ret}', params)
+            result.extend(c.fetchall())
+    return result
+
+
+def create_temp_table(name, column_def, values, batch_size=1000):
+    """
+    Creates a single column temporary table, which is dropped on commit. Must be called within transaction.
+    """
+    with connection.cursor() as c:
+        c.execute(f'CREATE TEMP TABLE {name} ({column_def}) ON COMMIT DROP')
+        for batch in _batches(list(values), batch_size):
+            c.execute(f'INSERT INTO {name} VALUES {", ".join(["(%s)"] * len(batch))} ON CONFLICT DO NOTHING', batch)
+        c.execute(f'ANALYZE {name}')
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,178 @@
+import time
+import logging
+import threading
+from datetime import timedelta
+
+from django.db.models import Max
+
+from kra import models
+
+log = logging.getLogger(__name__)
+
+# Container.started_at has seconds precision
+START_TIME_TOLERANCE = 1
+
+
+class ContainerIndex:
+    """
+    Resident lookup of live containers, either by (pod_uid, container_runtime_id)
+    or by (namespace, pod_name, container_name).
+
+    Refreshed incrementally: new containers are loaded by Container.id watermark, containers which are not seen
+    for `ttl` are evicted. Missed keys are retried in one batch query, not more often than `miss_retry_interval`.
+    Retrying misses also covers containers committed with id below the watermark.
+    """
+
+    def __init__(self, ttl=timedelta(minutes=10), miss_retry_interval=timedelta(minutes=1)):
+        self.ttl = ttl.total_seconds()
+        self.miss_retry_interval = miss_retry_interval.total_seconds()
+        self.entries = {}
+        self.names = {}
+        self.misses = {}
+        self.name_misses = {}
+        self.watermark = None
+        self.lock = threading.Lock()
+
+    def get(self, pod_uid, runtime_id):
+        """
+        :return: (container_id, started_at) or None
+        """
+        key = (pod_uid, runtime_id)
+        return self._get(self.entries.get(key), key, self.misses)
+
+    def get_by_name(self, namespace, pod_name, container_name, start_time=None, cpu_seconds=None):
+        """
+        Samples of a container restarted with the same name are not matched to the last started container,
+        if it's started before the sample's container (by `start_time`) or if cpu counter is reset
+        (by `cpu_seconds`), they are missed until the new container is loaded.
+        :param start_time: start time of the sample's container, unix timestamp
+        :param cpu_seconds: cumulative cpu usage of the sample's container
+        :return: (container_id, started_at) of the last started container with given name, or None
+        """
+        name_key = (namespace, pod_name, container_name)
+        key = self.names.get(name_key)
+        entry = self.entries.get(key) if key else None
+        if entry is not None and not entry.restarted:
+            if start_time is not None and start_time > entry.started_at.timestamp() + START_TIME_TOLERANCE:
+                log.debug('Container %s is restarted, sample is newer than container %d', name_key, entry.container_id)
+                entry.restarted = True
+            elif cpu_seconds is not None and entry.last_cpu_seconds is not None \
+                    and cpu_seconds < entry.last_cpu_seconds:
+                log.debug('Container %s is restarted, cpu counter of container %d is reset',
+                          name_key, entry.container_id)
+                entry.restarted = True
+            elif cpu_seconds is not None:
+                entry.last_cpu_seconds = cpu_seconds
+        if entry is not None and entry.restarted:
+            entry = None
+        return self._get(entry, name_key, self.name_misses)
+
+    def _get(self, entry, key, misses):
+        now = time.monotonic()
+        if entry is None:
+            with self.lock:
+                retry_at, _ = misses.get(key, (now, None))
+                misses[key] = (retry_at, now)
+            return None
+        entry.last_seen = now
+        return entry.container_id, entry.started_at
+
+    def refresh(self):
+        now = time.monotonic()
+
+        if self.watermark is None:
+            watermark = models.Container.objects.aggregate(watermark=Max('id'))['watermark'] or 0
+            loaded = self._load(models.Container.objects.filter(finished_at=None, id__lte=watermark), now)
+            self.watermark = watermark
+        else:
+            loaded = self._load(models.Container.objects.filter(id__gt=self.watermark), now)
+
+        retried, found = self._retry_misses(self.misses, now, self._misses_qs, self.entries)
+        name_retried, name_found = self._retry_misses(self.name_misses, now, self._name_misses_qs, self.names)
+
+        evicted = self._evict(now)
+
+        log.info('Container index: %d containers, %d loaded, %d evicted, %d of %d misses found, %d misses pending',
+                 len(self.entries), loaded, evicted, found + name_found, retried + name_retried,
+                 len(self.misses) + len(self.name_misses))
+
+    def _load(self, qs, now):
+        count = 0
+        qs = qs.values_list('id', 'pod__uid', 'runtime_id', 'started_at', 'pod__namespace', 'pod__name', 'name')
+        for container_id, pod_uid, runtime_id, started_at, namespace, pod_name, container_name in qs:
+            key = (str(pod_uid), runtime_id)
+            name_key = (namespace, pod_name, container_name)
+            entry = self.entries.get(key)
+            if entry is None or entry.container_id != container_id:
+                self.entries[key] = _Entry(container_id, started_at, name_key, now)
+            else:
+                # keep state of samples matched by name
+                entry.started_at = started_at
+                entry.last_seen = now
+
+            current = self.entries.get(self.names.get(name_key))
+            if current is None or current.started_at <= started_at:
+                self.names[name_key] = key
+
+            if self.watermark is not None and container_id > self.watermark:
+                self.watermark = container_id
+            count += 1
+        return count
+
+    @staticmethod
+    def _misses_qs(keys):
+        return models.Container.objects.filter(
+            pod__uid__in={pod_uid for pod_uid, _ in keys},
+            runtime_id__in={runtime_id for _, runtime_id in keys},
+        )
+
+    @staticmethod
+    def _name_misses_qs(name_keys):
+        return models.Container.objects.filter(
+            pod__namespace__in={namespace for namespace, _, _ in name_keys},
+            pod__name__in={pod_name for _, pod_name, _ in name_keys},
+            name__in={container_name for _, _, container_name in name_keys},
+            finished_at=None,
+        )
+
+    def _retry_misses(self, misses, now, make_qs, index):
+        with self.lock:
+            for key, (_, last_missed_at) in list(misses.items()):
+                if last_missed_at < now - self.ttl:
+                    del misses[key]
+            due = {key for key, (retry_at, _) in misses.items() if retry_at <= now}
+
+        if not due:
+            return 0, 0
+
+        self._load(make_qs(due), now)
+
+        found = 0
+        with self.lock:
+            for key in due:
+                if key in index:
+                    misses.pop(key, None)
+                    found += 1
+                elif key in misses:
+                    misses[key] = (now + self.miss_retry_interval, misses[key][1])
+        return len(due), found
+
+    def _evict(self, now):
+        stale = [key for key, entry in self.entries.items() if entry.last_seen < now - self.ttl]
+        for key in stale:
+            entry = self.entries.pop(key)
+            if self.names.get(entry.name_key) == key:
+                del self.names[entry.name_key]
+        return len(stale)
+
+
+class _Entry:
+    __slots__ = ('container_id', 'started_at', 'name_key', 'last_seen', 'last_cpu_seconds', 'restarted')
+
+    def __init__(self, container_id, started_at, name_key, last_seen):
+        self.container_id = container_id
+        self.started_at = started_at
+        self.name_key = name_key
+        self.last_seen = last_seen
+        self.last_cpu_seconds = None  # cpu counter of the last sample matched by name
+        self.restarted = False  # samples by name belong to a newer container
@@ -0,0 +1,90 @@
+import threading
+
+
+class Deadband:
+    """
+    Ingest filter, which skips samples while memory stays within `memory_tolerance_mi` of the last stored value
+    and cpu rate stays within `cpu_tolerance_m` of the last stored rate. A sample is stored at least each
+    `max_silence`.
+
+    Each stored value is weighted by time since the previous stored sample (see get_containers_summary),
+    so the last skipped sample is stored right before the sample which breaks the deadband. This way every stored
+    interval is covered by values within tolerance, and time-weighted stats of the sparse series stay the same.
+
+    Rows are tuples (container_id, measured_at, memory_mi, cpu_m_seconds).
+    """
+
+    def __init__(self, memory_tolerance_mi, cpu_tolerance_m, max_silence):
+        self.memory_tolerance_mi = memory_tolerance_mi
+        self.cpu_tolerance_m = cpu_tolerance_m
+        self.max_silence = max_silence.total_seconds()
+        self.states = {}
+        self.lock = threading.Lock()
+        self.skipped = 0
+
+    def filter(self, rows):
+        """
+        :return: rows to store
+        """
+        result = []
+        with self.lock:
+            for row in rows:
+                self._filter_row(row, result)
+        return result
+
+    def flush(self, before):
+        """
+        Stores pending skipped samples of containers, which are not seen since `before`, and forgets them.
+        :return: rows to store
+        """
+        result = []
+        with self.lock:
+            for container_id, state in list(self.states.items()):
+                last = state.skipped or state.stored
+                if last[1] >= before:
+                    continue
+                if state.skipped:
+                    result.append(state.skipped)
+                del self.states[container_id]
+        return result
+
+    def _filter_row(self, row, result):
+        container_id, measured_at, memory_mi, cpu_m_seconds = row
+        state = self.states.get(container_id)
+        if state is None:
+            self.states[container_id] = _State(row)
+            result.append(row)
+            return
+
+        prev = state.skipped or state.stored
+        seconds = (measured_at - prev[1]).total_seconds()
+        if seconds <= 0:
+            return
+        cpu_m = (cpu_m_seconds - prev[3]) / seconds
+        silence = (measured_at - state.stored[1]).total_seconds()
+
+        if state.cpu_m is not None \
+                and abs(memory_mi - state.stored[2]) <= self.memory_tolerance_mi \
+                and abs(cpu_m - state.cpu_m) <= self.cpu_tolerance_m:
+            if silence < self.max_silence:
+                state.skipped = row
+                self.skipped += 1
+                return
+            # heartbeat, current sample is within tolerance, so skipped one is not needed
+            state.skipped = None
+
+        if state.skipped:
+            result.append(state.skipped)
+            state.skipped = None
+        result.append(row)
+        state.stored = row
+        state.cpu_m = cpu_m
+
+
+class _State:
+    __slots__ = ('stored', 'skipped', 'cpu_m')
+
+    def __init__(self, stored):
+        self.stored = stored
+        self.skipped = None
+        self.cpu_m = None
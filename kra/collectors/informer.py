@@ -0,0 +1,40 @@
+import logging
+import threading
+
+import kubernetes
+from django.conf import settings
+
+from utils.threading import SupervisedThread
+from utils.kubernetes.watch import WatchEventType
+
+from kra.collectors import records
+from kra.collectors.watch import ResumableWatcher
+
+log = logging.getLogger(__name__)
+
+
+class PodInformer(SupervisedThread):
+    """
+    Local cache of all pods by uid, kept current by a watch. Readers in other threads call `get`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        v1 = kubernetes.client.CoreV1Api()
+        decode = records.decode_pod if settings.WATCH_RAW_DECODING else None
+        self.watcher = ResumableWatcher(v1.list_pod_for_all_namespaces, name=None, decode=decode)
+        self.synced = threading.Event()
+
+    def run_supervised(self):
+        for event_type, _ in self.watcher:
+            if event_type == WatchEventType.DONE_INITIAL:
+                log.info('Pod cache is synced, %d pods', len(self.watcher.db))
+                self.synced.set()
+
+    def get(self, uid):
+        """
+        :return: pod, or None if pod is unknown or cache is not synced yet
+        """
+        if not self.synced.is_set():
+            return None
+        return self.watcher.db.get(str(uid))
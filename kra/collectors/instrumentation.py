@@ -0,0 +1,40 @@
+import logging
+
+from django.conf import settings
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+log = logging.getLogger(__name__)
+
+SCRAPE_SECONDS = Histogram(
+    'kra_scrape_duration_seconds', 'Kubelet scrape latency',
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60))
+SCRAPE_BYTES = Counter('kra_scrape_bytes', 'Kubelet scrape payload size', ['kind'])
+SCRAPE_FAILURES = Counter('kra_scrape_failures', 'Failed node collections', ['node'])
+SCRAPE_LAG = Gauge('kra_scrape_lag_seconds', 'Delay of the last node scrape after its due time', ['node'])
+SCRAPE_OVERRUNS = Counter('kra_scrape_overruns', 'Node scrapes skipped, because previous one is still running')
+
+SAMPLES = Counter('kra_samples', 'Container samples', ['state'])
+UNKNOWN_CONTAINERS = Counter('kra_unknown_containers', 'Samples of containers missing in container index')
+
+QUEUE_DEPTH = Gauge('kra_queue_depth', 'Items in collector queue', ['queue'])
+SPOOL_BYTES = Gauge('kra_spool_bytes', 'Size of metrics spool on disk')
+DB_WRITE_SECONDS = Histogram('kra_db_write_duration_seconds', 'Database write latency', ['operation'])
+
+EVENTS = Counter('kra_events', 'Handled watch events', ['collector', 'type'])
+EVENT_SECONDS = Histogram('kra_event_handle_duration_seconds', 'Watch event handling latency', ['collector'])
+EVENT_AGE = Histogram(
+    'kra_event_age_seconds', 'Time watch event spent in queue before handling', ['collector'],
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 600))
+POD_UPDATES = Counter('kra_pod_updates', 'Pod updates, skipped ones did not change persisted fields', ['result'])
+RETRIES_PENDING = Gauge('kra_retries_pending', 'Events waiting for retry', ['collector'])
+RETRIES_EXHAUSTED = Counter('kra_retries_exhausted', 'Events dropped after last retry attempt', ['collector'])
+OWNER_CACHE = Counter('kra_owner_cache_lookups', 'Owner resolution cache lookups', ['result'])
+POD_CACHE = Counter('kra_pod_cache_lookups', 'Local pod cache lookups, misses are read from API', ['result'])
+
+
+def start_metrics_server():
+    port = settings.COLLECTOR_METRICS_PORT
+    if port is None:
+        return
+    log.info('Serving collector metrics on port %d', port)
+    start_http_server(port)
@@ -0,0 +1,78 @@
+import gzip
+import time
+import threading
+from collections import namedtuple
+
+import kubernetes
+import kubernetes.client
+
+Scrape = namedtuple('Scrape', ['payload', 'wire_bytes', 'payload_bytes', 'seconds'])
+
+
+class KubeletClient:
+    """
+    Long-lived client for kubelet endpoints, proxied by API server.
+    Keeps up to `pool_size` keep-alive connections to API server and requests gzipped responses.
+    """
+
+    def __init__(self, pool_size, timeout):
+        configuration = kubernetes.client.Configuration.get_default_copy()
+        configuration.connection_pool_maxsize = pool_size
+        self.api_client = kubernetes.client.ApiClient(configuration)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.totals = self._empty_totals()
+
+    def scrape(self, node_name, path):
+        """
+        :param node_name: str
+        :param path: kubelet path, e.g. 'metrics/cadvisor'
+        :return: Scrape
+        """
+        start = time.monotonic()
+        response, _, _ = self.api_client.call_api(
+            f'/api/v1/nodes/{{node}}/proxy/{path}', 'GET',
+            path_params={
+                'node': node_name,
+            },
+            header_params={
+                'Accept-Encoding': 'gzip',
+            },
+            auth_settings=['BearerToken'],
+            _preload_content=False,
+            _request_timeout=self.timeout.total_seconds(),
+        )
+        try:
+            data = response.read(decode_content=False)
+        finally:
+            response.release_conn()
+        wire_bytes = len(data)
+        if response.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        scrape = Scrape(data.decode('utf-8'), wire_bytes, len(data), time.monotonic() - start)
+
+        with self.lock:
+            self.totals['scrapes'] += 1
+            self.totals['wire_bytes'] += scrape.wire_bytes
+            self.totals['payload_bytes'] += scrape.payload_bytes
+            self.totals['seconds'] += scrape.seconds
+
+        return scrape
+
+    def pop_totals(self):
+        """
+        :return: dict of counters accumulated since previous call
+        """
+        with self.lock:
+            totals = self.totals
+            self.totals = self._empty_totals()
+        return totals
+
+    @staticmethod
+    def _empty_totals():
+        return {
+            'scrapes': 0,
+            'wire_bytes': 0,
+            'payload_bytes': 0,
+            'seconds': 0.0,
+        }
@@ -1,36 +1,67 @@
 import math
 import time
+import atexit
 import logging
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import kubernetes
 import kubernetes.client.rest
+from django.conf import settings
 from django.utils import timezone
-from prometheus_client.parser import text_string_to_metric_families
 
 from utils.threading import SupervisedThread, SupervisedThreadGroup
-from utils.kubernetes.watch import KubeWatcher
 from utils.signal import install_shutdown_signal_handlers
 from utils.django.db import fix_long_connections
 
-from kra import models
-from kra.utils import parse_cgroup
+from kra.collectors.parser import parse_container_samples, parse_resource_samples
+from kra.collectors.kubelet import KubeletClient
+from kra.collectors.container_index import ContainerIndex
+from kra.collectors.sharding import get_shard, LeaseShard
+from kra.collectors.scheduler import NodeScheduler
+from kra.collectors.spool import Spool, SpoolWriterThread
+from kra.collectors.deadband import Deadband
+from kra.collectors import instrumentation
+from kra.collectors import records
+from kra.collectors.watch import ResumableWatcher
 
 log = logging.getLogger(__name__)
 
 MEBIBYTE = 1024 * 1024
+SAMPLE_NAMES = {'container_memory_working_set_bytes', 'container_cpu_usage_seconds_total'}
+# start time tells apart restarted containers, which have the same name
+RESOURCE_SAMPLE_NAMES = SAMPLE_NAMES | {'container_start_time_seconds'}
 
 
 def main():
     install_shutdown_signal_handlers()
+    instrumentation.start_metrics_server()
 
     v1 = kubernetes.client.CoreV1Api()
-    watcher = KubeWatcher(v1.list_node)
+    decode = records.decode_node if settings.WATCH_RAW_DECODING else None
+    watcher = ResumableWatcher(v1.list_node, name=None, decode=decode)
+
+    shard = get_shard('kra-metric-collector')
+    spool = Spool(
+        path=settings.METRICS_SPOOL_DIR,
+        queue_size=settings.METRICS_QUEUE_SIZE,
+        max_bytes=settings.METRICS_SPOOL_MAX_BYTES,
+        drop_policy=settings.METRICS_SPOOL_DROP_POLICY,
+    )
+    atexit.register(spool.flush)
+    instrumentation.QUEUE_DEPTH.labels(queue='metrics').set_function(spool.queue.qsize)
+    instrumentation.SPOOL_BYTES.set_function(spool.size)
 
     threads = SupervisedThreadGroup()
     threads.add_thread(WatcherThread(watcher))
-    threads.add_thread(CollectorThread(watcher.db))
+    if isinstance(shard, LeaseShard):
+        threads.add_thread(shard)
+    collector = CollectorThread(watcher.db, shard, spool)
+    # registered after spool.flush, so that it's called before it
+    atexit.register(collector.flush_deadband)
+    threads.add_thread(collector)
+    threads.add_thread(SpoolWriterThread(spool))
     threads.start_all()
     threads.wait_any()
 
@@ -46,87 +77,197 @@ class WatcherThread(SupervisedThread):
 
 
 class CollectorThread(SupervisedThread):
-    def __init__(self, node_db, collect_interval=timedelta(minutes=1)):
+    def __init__(self, node_db, shard, spool, collect_interval=timedelta(minutes=1),
+                 concurrency=settings.METRICS_COLLECT_CONCURRENCY, scrape_timeout=settings.METRICS_SCRAPE_TIMEOUT,
+                 scrape_mode=settings.METRICS_SCRAPE_MODE):
         super().__init__()
         self.node_db = node_db
+        self.shard = shard
+        self.spool = spool
+        if settings.METRICS_DEADBAND:
+            self.deadband = Deadband(
+                memory_tolerance_mi=settings.METRICS_DEADBAND_MEMORY_MI,
+                cpu_tolerance_m=settings.METRICS_DEADBAND_CPU_M,
+                max_silence=settings.METRICS_DEADBAND_MAX_SILENCE,
+            )
+        else:
+            self.deadband = None
         self.collect_interval = collect_interval
+        self.scrape_mode = scrape_mode
+        self.cadvisor_nodes = set()
+        self.kubelet = KubeletClient(pool_size=concurrency, timeout=scrape_timeout)
+        self.container_index = ContainerIndex()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='node-collector')
+        self.scheduler = NodeScheduler(collect_interval)
+        self.in_flight = set()
+        self.lags = {}
+        self.overruns = 0
 
     def run_supervised(self):
+        next_refresh_at = 0
         while True:
-            start = timezone.now()
-            fix_long_connections()
-            self.collect()
-            end = timezone.now()
-            elapsed = end - start
-            to_wait = self.collect_interval - elapsed
-            to_wait_seconds = to_wait.total_seconds()
-            if to_wait_seconds > 0:
-                log.info('Waiting %d seconds for next collect cycle', to_wait_seconds)
-                time.sleep(to_wait_seconds)
-
-    def collect(self):
-        nodes = list(self.node_db.values())
-        for node in nodes:
-            try:
-                self.collect_node(node)
-            except Exception:
-                log.exception('Failed to collect node')
+            now = time.monotonic()
+            if now >= next_refresh_at:
+                self.refresh()
+                next_refresh_at = now + self.collect_interval.total_seconds()
 
-    def collect_node(self, node):
-        log.info('Collecting node %s', node.metadata.name)
+            self.schedule(now)
 
-        metrics = {family.name: family for family in text_string_to_metric_families(self.scrap_node(node))}
-        squashed_metrics = defaultdict(dict)
-        self.squash(metrics, 'container_memory_working_set_bytes', squashed_metrics)
-        self.squash(metrics, 'container_cpu_usage_seconds', squashed_metrics)
+            next_due = self.scheduler.next_due()
+            to_wait = 1 if next_due is None else next_due - time.monotonic()
+            if to_wait > 0:
+                # wake up at least every second to pick up added and removed nodes
+                time.sleep(min(to_wait, 1))
 
-        for (pod_uid, container_runtime_id), container_metrics in squashed_metrics.items():
-            try:
-                self.collect_container(pod_uid, container_runtime_id, container_metrics)
-            except Exception:
-                log.exception('Failed to collect container %s in pod %s', container_runtime_id, pod_uid)
-
-    def scrap_node(self, node):
-        client = kubernetes.client.ApiClient()
-        response = client.call_api(
-            '/api/v1/nodes/{node}/proxy/metrics/cadvisor', 'GET',
-            path_params={
-                'node': node.metadata.name,
-            },
-            auth_settings=['BearerToken'],
-            response_type='object'
-        )
-        return response[0]
+    def refresh(self):
+        fix_long_connections()
+        try:
+            self.container_index.refresh()
+        except Exception:
+            log.exception('Failed to refresh container index')
 
-    def squash(self, metrics, metric_name, data):
-        for sample in metrics[metric_name].samples:
-            container_name = sample.labels['container']
-            if not container_name or container_name == 'POD':
+        if self.deadband:
+            # containers gone from scrapes for two intervals
+            rows = self.deadband.flush(timezone.now() - self.collect_interval * 2)
+            self.spool.put(rows)
+            log.info('Deadband: %d samples skipped since start, %d flushed', self.deadband.skipped, len(rows))
+
+        totals = self.kubelet.pop_totals()
+        log.info('Scraped %d nodes: %d bytes (%d bytes transferred), %.3f seconds total',
+                 totals['scrapes'], totals['payload_bytes'], totals['wire_bytes'], totals['seconds'])
+
+        # copy, as lags are set by worker threads
+        lags = dict(self.lags)
+        if lags:
+            max_lag_node_name = max(lags, key=lags.get)
+            log.info('Max scrape lag %.3f seconds (node %s), %d overruns',
+                     lags[max_lag_node_name], max_lag_node_name, self.overruns)
+        self.overruns = 0
+
+    def flush_deadband(self):
+        """
+        Queues all pending skipped samples, e.g. on shutdown, so that samples after restart are not weighted
+        over the skipped interval.
+        """
+        if not self.deadband:
+            return
+        rows = self.deadband.flush(datetime.max.replace(tzinfo=dt_timezone.utc))
+        self.spool.put(rows)
+        log.info('Deadband: %d skipped samples flushed', len(rows))
+
+    def schedule(self, now):
+        node_names = [node.metadata.name for node in list(self.node_db.values())]
+        added, removed = self.scheduler.sync((name for name in node_names if self.shard.owns(name)), now)
+        for node_name in added:
+            log.info('Scheduled node %s', node_name)
+        for node_name in removed:
+            log.info('Unscheduled node %s', node_name)
+            if self.lags.pop(node_name, None) is not None:
+                instrumentation.SCRAPE_LAG.remove(node_name)
+
+        for node_name, due in self.scheduler.pop_due(now):
+            if node_name in self.in_flight:
+                log.warning('Node %s is still being collected, skipping (lag %.3f seconds)', node_name, now - due)
+                self.overruns += 1
+                instrumentation.SCRAPE_OVERRUNS.inc()
                 continue
+            self.in_flight.add(node_name)
+            future = self.executor.submit(self.collect_node_isolated, node_name, due)
+            future.add_done_callback(lambda _, node_name=node_name: self.in_flight.discard(node_name))
+
+    def collect_node_isolated(self, node_name, due):
+        # lag is measured when a worker starts the scrape, so that it includes waiting in executor queue
+        lag = time.monotonic() - due
+        if self.scheduler.is_scheduled(node_name):
+            self.lags[node_name] = lag
+            instrumentation.SCRAPE_LAG.labels(node=node_name).set(lag)
+        try:
+            self.collect_node(node_name)
+        except Exception:
+            log.exception('Failed to collect node %s', node_name)
+            instrumentation.SCRAPE_FAILURES.labels(node=node_name).inc()
+
+    def collect_node(self, node_name):
+        log.info('Collecting node %s', node_name)
 
-            cgroup = sample.labels['id']
-            pod_uid, container_runtime_id = parse_cgroup(cgroup)
-            if not pod_uid:
+        scrape, samples, lookup = self.scrape_node(node_name)
+        # use our own timestamp, taken right after scraping, so that it doesn't depend on other nodes
+        measured_at = timezone.now()
+        log.debug('Scraped node %s: %d bytes (%d bytes transferred) in %.3f seconds',
+                  node_name, scrape.payload_bytes, scrape.wire_bytes, scrape.seconds)
+        instrumentation.SCRAPE_SECONDS.observe(scrape.seconds)
+        instrumentation.SCRAPE_BYTES.labels(kind='payload').inc(scrape.payload_bytes)
+        instrumentation.SCRAPE_BYTES.labels(kind='transferred').inc(scrape.wire_bytes)
+
+        rows = []
+        for key, container_metrics in self.squash(samples).items():
+            container = lookup(key, container_metrics)
+            if container is None:
+                log.debug('Container %s not found', key)
+                instrumentation.UNKNOWN_CONTAINERS.inc()
                 continue
-            if '-' not in pod_uid:
-                # skip pods started directly by kubelet
+            container_id, started_at = container
+            if measured_at < started_at:
+                # same check as in ResourceUsage.save, which is bypassed by bulk insert
+                log.debug('Container %s is not started yet', key)
                 continue
+            try:
+                rows.append(make_row(container_id, container_metrics, measured_at))
+            except Exception:
+                log.exception('Failed to collect container %s', key)
 
-            data[pod_uid, container_runtime_id][metric_name] = sample.value
-            # use our own timestamp, because their timestamp differs for each metric
-            # data[pod_uid, container_runtime_id]['timestamp'] = sample.timestamp
+        instrumentation.SAMPLES.labels(state='collected').inc(len(rows))
+        if self.deadband:
+            rows = self.deadband.filter(rows)
+        instrumentation.SAMPLES.labels(state='queued').inc(len(rows))
+        self.spool.put(rows)
+        log.info('Queued %d samples for node %s', len(rows), node_name)
+
+    def scrape_node(self, node_name):
+        """
+        :return: (scrape, samples, container lookup function for sample keys and squashed samples)
+        """
+        if self.scrape_mode == 'resource' and node_name not in self.cadvisor_nodes:
+            try:
+                scrape = self.kubelet.scrape(node_name, 'metrics/resource')
+            except kubernetes.client.rest.ApiException as e:
+                if e.status != 404:
+                    raise e
+                log.warning('No /metrics/resource on node %s, falling back to /metrics/cadvisor', node_name)
+                self.cadvisor_nodes.add(node_name)
+            else:
+                samples = parse_resource_samples(scrape.payload.splitlines(), RESOURCE_SAMPLE_NAMES)
+                return scrape, samples, self.lookup_by_name
+
+        scrape = self.kubelet.scrape(node_name, 'metrics/cadvisor')
+        samples = parse_container_samples(scrape.payload.splitlines(), SAMPLE_NAMES)
+        return scrape, samples, self.lookup
+
+    def lookup(self, key, container_metrics):
+        return self.container_index.get(*key)
+
+    def lookup_by_name(self, key, container_metrics):
+        return self.container_index.get_by_name(
+            *key,
+            start_time=container_metrics.get('container_start_time_seconds'),
+            cpu_seconds=container_metrics.get('container_cpu_usage_seconds_total'),
+        )
+
+    def squash(self, samples):
+        # sample timestamps are dropped, because their timestamp differs for each metric
+        data = defaultdict(dict)
+        for sample_name, key, value in samples:
+            data[key][sample_name] = value
+        return data
 
-    def collect_container(self, pod_uid, runtime_id, container_metrics):
-        try:
-            container = models.Container.objects.get(pod__uid=pod_uid, runtime_id=runtime_id)
-        except models.Container.DoesNotExist:
-            log.debug('Container %s not found for pod %s', runtime_id, pod_uid)
-            return
 
-        usage = models.ResourceUsage(container=container)
-        # See
-        # https://stackoverflow.com/questions/65428558/what-is-the-difference-between-container-memory-working-set-bytes-and-contain
-        # https://stackoverflow.com/questions/66832316/what-is-the-relation-between-container-memory-working-set-bytes-metric-and-oom
-        usage.memory_mi = math.ceil(container_metrics['container_memory_working_set_bytes'] / MEBIBYTE)
-        usage.cpu_m_seconds = container_metrics['container_cpu_usage_seconds'] * 1000
-        usage.save()
+def make_row(container_id, container_metrics, measured_at):
+    """
+    :return: ResourceUsage row for Spool
+    """
+    # See
+    # https://stackoverflow.com/questions/65428558/what-is-the-difference-between-container-memory-working-set-bytes-and-contain
+    # https://stackoverflow.com/questions/66832316/what-is-the-relation-between-container-memory-working-set-bytes-metric-and-oom
+    memory_mi = math.ceil(container_metrics['container_memory_working_set_bytes'] / MEBIBYTE)
+    cpu_m_seconds = int(container_metrics['container_cpu_usage_seconds_total'] * 1000)
+    return container_id, measured_at, memory_mi, cpu_m_seconds
@@ -1,18 +1,22 @@
 import re
 import queue
 import logging
-import threading
 
 import kubernetes
 import kubernetes.client
+from django.conf import settings
 
 from utils.threading import SupervisedThread, SupervisedThreadGroup
-from utils.kubernetes.watch import KubeWatcher, WatchEventType
+from utils.kubernetes.watch import WatchEventType
 from utils.signal import install_shutdown_signal_handlers
 from utils.django.db import fix_long_connections
 
 from kra import kube
 from kra import models
+from kra.collectors import instrumentation
+from kra.collectors.informer import PodInformer
+from kra.collectors.retry import RetryThread
+from kra.collectors.watch import ResumableWatcher, Checkpointer
 from kra.utils import parse_cgroup
 
 log = logging.getLogger(__name__)
@@ -21,64 +25,96 @@ MEBIBYTE = 1024 * 1024
 target_message_re = re.compile(r'Kill\s+process\s+(\d+)\s+\((.*)\)')
 victim_message_re = re.compile(r'Killed\s+process\s+(\d+)\s+\((.*)\)')
 sys_victim_message_re = re.compile(r'victim\s+process:\s*(.*),\s+pid:\s*(\d+)')
-retry_delay = 30
+# filtered by API server, so that other events are not sent and deserialized
+EVENT_SELECTOR = 'reason=NodeOOM,involvedObject.kind=Node'
 
 
 def main():
     install_shutdown_signal_handlers()
+    instrumentation.start_metrics_server()
+
+    v1 = kubernetes.client.CoreV1Api()
+    watcher = ResumableWatcher(v1.list_event_for_all_namespaces, 'node-oom-events', field_selector=EVENT_SELECTOR)
+    checkpointer = Checkpointer(watcher)
 
     q = queue.Queue()
+    instrumentation.QUEUE_DEPTH.labels(queue='oom').set_function(q.qsize)
+    pod_informer = PodInformer()
+    retries = RetryThread(q.put, base_delay=settings.OOM_RETRY_DELAY, max_delay=settings.OOM_RETRY_MAX_DELAY)
+    instrumentation.RETRIES_PENDING.labels(collector='oom').set_function(retries.pending)
     threads = SupervisedThreadGroup()
-    threads.add_thread(WatcherThread(q))
-    threads.add_thread(HandlerThread(q))
+    threads.add_thread(WatcherThread(watcher, q, checkpointer))
+    threads.add_thread(HandlerThread(q, retries, pod_informer, checkpointer))
+    threads.add_thread(retries)
+    threads.add_thread(pod_informer)
     threads.start_all()
     threads.wait_any()
 
 
 class WatcherThread(SupervisedThread):
-    def __init__(self, queue):
+    def __init__(self, watcher, queue, checkpointer):
         super().__init__()
+        self.watcher = watcher
         self.queue = queue
+        self.checkpointer = checkpointer
 
     def run_supervised(self):
-        v1 = kubernetes.client.CoreV1Api()
-        watcher = iter(KubeWatcher(v1.list_event_for_all_namespaces))
-
-        for event_type, event in watcher:
+        # events of initial listing are old, but events yielded after resume are missed while collector was down;
+        # the checkpoint moves only with NodeOOM events, so it's usually expired and events are listed after resume,
+        # listed events are handled then (already saved ones are skipped by handler)
+        initial = True
+        for event_type, event in self.watcher:
             if event_type == WatchEventType.DONE_INITIAL:
-                break
-
-        for event_type, event in watcher:
-            if event_type != WatchEventType.ADDED:
-                continue
-            if event.reason != 'NodeOOM':
-                continue
-            self.queue.put(event)
+                initial = False
+            elif (not initial or self.watcher.resumed) \
+                    and event_type == WatchEventType.ADDED and event.reason == 'NodeOOM':
+                self.queue.put(event)
+                self.checkpointer.queued()
+            self.checkpointer.checkpoint()
 
 
 class HandlerThread(SupervisedThread):
-    def __init__(self, queue):
+    def __init__(self, queue, retries, pod_informer, checkpointer, max_attempts=settings.OOM_RETRY_MAX_ATTEMPTS):
         super().__init__()
         self.queue = queue
+        self.retries = retries
+        self.pod_informer = pod_informer
+        self.checkpointer = checkpointer
+        self.max_attempts = max_attempts
 
     def run_supervised(self):
         while True:
             event = self.queue.get()
             fix_long_connections()
+            instrumentation.EVENTS.labels(collector='oom', type='NodeOOM').inc()
+            retrying = False
             try:
-                self.handle(event)
+                with instrumentation.EVENT_SECONDS.labels(collector='oom').time():
+                    retrying = self.handle(event)
             except Exception:
                 log.exception('Failed to handle %s', event.metadata.name)
+            finally:
+                # event is handled when it won't be retried anymore
+                if not retrying:
+                    self.checkpointer.handled()
 
     def handle(self, event):
+        """
+        :return: True if event is scheduled for retry
+        """
         try:
             self._handle(event)
         except models.Container.DoesNotExist as err:
-            if getattr(event, '_retry', None):
+            attempt = getattr(event, '_attempt', 1)
+            if attempt >= self.max_attempts:
+                instrumentation.RETRIES_EXHAUSTED.labels(collector='oom').inc()
                 raise err
-            log.info('Container not found, will retry in %s seconds', retry_delay)
-            event._retry = True
-            threading.Timer(retry_delay, lambda: self.queue.put(event)).start()
+            event._attempt = attempt + 1
+            delay = self.retries.schedule(event, attempt)
+            log.info('Container not found, will retry in %s seconds (attempt %d of %d)',
+                     delay, attempt + 1, self.max_attempts)
+            return True
+        return False
 
     def _handle(self, event):
         log.info('Event: %s', event.metadata.name)
@@ -88,6 +124,11 @@ class HandlerThread(SupervisedThread):
             raise Exception(f'No cgroup in message "{event.message}"')
         container = get_container(cgroup)
 
+        if models.OOMEvent.objects.filter(container=container, happened_at=event.last_timestamp).exists():
+            # event is repeated after resume
+            log.info('OOM is already saved')
+            return
+
         oom = models.OOMEvent(
             happened_at=event.last_timestamp,
             container=container,
@@ -97,7 +138,7 @@ class HandlerThread(SupervisedThread):
         )
 
         try:
-            kube_pod = kube.get_pod_obj(container.pod)
+            kube_pod = self.get_pod_obj(container.pod)
             container_status = next(s for s in kube_pod.status.container_statuses if s.name == container.name)
             if container_status.state.terminated:
                 oom.is_critical = True
@@ -110,6 +151,13 @@ class HandlerThread(SupervisedThread):
         oom.save()
         log.info(f'OOM: {container.pod.namespace}/{container.pod.name}, container: {container.name}, comm: {comm}')
 
+    def get_pod_obj(self, pod):
+        kube_pod = self.pod_informer.get(pod.uid)
+        instrumentation.POD_CACHE.labels(result='miss' if kube_pod is None else 'hit').inc()
+        if kube_pod is None:
+            kube_pod = kube.get_pod_obj(pod)
+        return kube_pod
+
 
 def get_container(cgroup):
     pod_uid, container_runtime_id = parse_cgroup(cgroup)
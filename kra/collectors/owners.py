@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+from datetime import timedelta
+from collections import namedtuple
+
+from kra import kube
+from kra import models
+from kra.collectors import instrumentation
+
+log = logging.getLogger(__name__)
+
+Owner = namedtuple('Owner', ['kind', 'name'])
+Ref = namedtuple('Ref', ['kind', 'name', 'uid'])
+
+
+class OwnerCache:
+    """
+    Resolves top-level controller of an object.
+    Resolutions are cached by owner reference (kind, namespace, name, uid) for `ttl`, so that resolving an already
+    seen owner costs no API call. Recreated owner gets new uid, so it is never resolved from stale entry.
+    """
+
+    def __init__(self, ttl=timedelta(hours=1), max_size=100000):
+        self.ttl = ttl.total_seconds()
+        self.max_size = max_size
+        self.cache = {}
+        self.preloaded = {}
+        self.lock = threading.Lock()
+
+    def preload(self):
+        """
+        Lists all objects of workload kinds, so that following resolutions make no reads.
+        Only controller references are kept, call `clear_preloaded` when done.
+        """
+        for kind, list_func in kube.list_funcs.items():
+            try:
+                objs = list_func().items
+            except Exception:
+                log.warning('Failed to list %s objects', kind.name, exc_info=True)
+                continue
+            for obj in objs:
+                key = (kind.name, obj.metadata.namespace, obj.metadata.name)
+                ref = get_controller_ref(obj)
+                ref = ref and Ref(ref.kind, ref.name, ref.uid)
+                self.preloaded[key] = (obj.metadata.uid, ref)
+            log.info('Preloaded %d %s objects', len(objs), kind.name)
+
+    def clear_preloaded(self):
+        self.preloaded = {}
+
+    def get_owner(self, obj):
+        """
+        :return: Owner or None
+        """
+        ref = get_controller_ref(obj)
+        if ref is None:
+            return None
+        return self.resolve(ref.kind, obj.metadata.namespace, ref.name, ref.uid)
+
+    def resolve(self, kind, namespace, name, uid):
+        if kind == 'Node':
+            # static pod
+            return None
+
+        key = (kind, namespace, name, uid)
+        now = time.monotonic()
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached is not None and cached[1] > now:
+            instrumentation.OWNER_CACHE.labels(result='hit').inc()
+            return cached[0]
+        instrumentation.OWNER_CACHE.labels(result='miss').inc()
+
+        preloaded_uid, ref = self.preloaded.get((kind, namespace, name), (None, None))
+        if preloaded_uid != uid:
+            read_func = kube.read_funcs[models.WorkloadKind[kind]]
+            ref = get_controller_ref(read_func(name, namespace))
+
+        owner = None
+        if ref is not None:
+            owner = self.resolve(ref.kind, namespace, ref.name, ref.uid)
+        owner = owner or Owner(kind, name)
+
+        with self.lock:
+            if len(self.cache) >= self.max_size:
+                self._purge(now)
+            self.cache[key] = (owner, now + self.ttl)
+        return owner
+
+    def _purge(self, now):
+        for key, (_, expires_at) in list(self.cache.items()):
+            if expires_at <= now:
+                del self.cache[key]
+        if len(self.cache) >= self.max_size:
+            self.cache.clear()
+
+
+def get_controller_ref(obj):
+    for ref in obj.metadata.owner_references or []:
+        if ref.controller:
+            return ref
+    return None
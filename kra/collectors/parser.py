@@ -0,0 +1,110 @@
+import re
+
+from kra.utils import parse_cgroup
+
+escape_re = re.compile(r'\\(.)')
+
+
+def parse_container_samples(lines, sample_names):
+    """
+    Parses kubelet /metrics/cadvisor output.
+
+    :param lines: iterable of str
+    :param sample_names: set of sample names to parse, e.g. {'container_cpu_usage_seconds_total'}
+    :return: generator of (sample_name, (pod_uid, container_runtime_id), value)
+    """
+    for name, labels, value in parse_samples(lines, sample_names):
+        container_name = labels.get('container')
+        if not container_name or container_name == 'POD':
+            continue
+
+        pod_uid, container_runtime_id = parse_cgroup(labels.get('id', ''))
+        if not pod_uid:
+            continue
+        if '-' not in pod_uid:
+            # skip pods started directly by kubelet
+            continue
+
+        yield name, (pod_uid, container_runtime_id), value
+
+
+def parse_resource_samples(lines, sample_names):
+    """
+    Parses kubelet /metrics/resource output, which identifies containers by names only.
+
+    :param lines: iterable of str
+    :param sample_names: set of sample names to parse, e.g. {'container_cpu_usage_seconds_total'}
+    :return: generator of (sample_name, (namespace, pod_name, container_name), value)
+    """
+    for name, labels, value in parse_samples(lines, sample_names):
+        container_name = labels.get('container')
+        namespace = labels.get('namespace')
+        pod_name = labels.get('pod')
+        if not container_name or not namespace or not pod_name:
+            continue
+
+        yield name, (namespace, pod_name, container_name), value
+
+
+def parse_samples(lines, sample_names):
+    """
+    Selective parser of prometheus text exposition format.
+    Lines of unwanted metrics are skipped before their labels are tokenized.
+    Samples without labels are skipped too.
+
+    :param lines: iterable of str
+    :param sample_names: set of sample names to parse
+    :return: generator of (sample_name, labels, value)
+    """
+    for line in lines:
+        brace = line.find('{')
+        if brace <= 0 or line[0] == '#':
+            continue
+        name = line[:brace]
+        if name not in sample_names:
+            continue
+
+        labels, end = parse_labels(line, brace + 1)
+
+        # timestamp, if any, is ignored
+        value = line[end:].split(None, 1)[0]
+        yield name, labels, float(value)
+
+
+def parse_labels(line, pos):
+    """
+    :param line: str
+    :param pos: position after opening brace
+    :return: (labels, position after closing brace)
+    """
+    labels = {}
+    while True:
+        while line[pos] in ' ,':
+            pos += 1
+        if line[pos] == '}':
+            return labels, pos + 1
+
+        eq = line.index('="', pos)
+        start = eq + 2
+        end = line.index('"', start)
+        while _is_escaped(line, end):
+            end = line.index('"', end + 1)
+        value = line[start:end]
+        if '\\' in value:
+            value = escape_re.sub(_unescape, value)
+        labels[line[pos:eq].strip()] = value
+        pos = end + 1
+
+
+def _unescape(match):
+    c = match.group(1)
+    return '\n' if c == 'n' else c
+
+
+def _is_escaped(line, pos):
+    backslashes = 0
+    pos -= 1
+    while line[pos] == '\\':
+        backslashes += 1
+        pos -= 1
+    return backslashes % 2 == 1
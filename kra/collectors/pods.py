@@ -1,69 +1,179 @@
+import uuid
+import time
 import queue
 import logging
+import threading
+from collections import defaultdict
 
 import kubernetes
 import kubernetes.client.rest
-from django.db import IntegrityError
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
 from django.utils import timezone
 
 from utils.threading import SupervisedThread, SupervisedThreadGroup
-from utils.kubernetes.watch import KubeWatcher, WatchEventType
+from utils.kubernetes.watch import WatchEventType
 from utils.signal import install_shutdown_signal_handlers
 from utils.django.db import retry_on_connection_close
 
 from kra import kube
 from kra import models
+from kra.collectors import bulk
+from kra.collectors import instrumentation
+from kra.collectors import records
+from kra.collectors.owners import OwnerCache, get_controller_ref
+from kra.collectors.watch import ResumableWatcher, Checkpointer, RESUMED
 
 log = logging.getLogger(__name__)
 
+owner_cache = OwnerCache()
+
+# workload of pod could not be resolved
+UNKNOWN = object()
+
+# set by kube.get_container_resources only if present in spec
+CONTAINER_RESOURCE_FIELDS = ('memory_limit_mi', 'cpu_request_m')
+
 
 def main():
     install_shutdown_signal_handlers()
+    instrumentation.start_metrics_server()
 
-    q = queue.Queue()
+    v1 = kubernetes.client.CoreV1Api()
+    decode = records.decode_pod if settings.WATCH_RAW_DECODING else None
+    watcher = ResumableWatcher(v1.list_pod_for_all_namespaces, 'pods', decode=decode)
+
+    queues = []
+    for i in range(settings.POD_HANDLER_WORKERS):
+        q = queue.Queue(maxsize=settings.POD_QUEUE_SIZE)
+        instrumentation.QUEUE_DEPTH.labels(queue=f'pods-{i}').set_function(q.qsize)
+        queues.append(q)
+
+    checkpointer = Checkpointer(watcher, partitions=len(queues))
+    initial_sync = InitialSync(len(queues))
     threads = SupervisedThreadGroup()
-    threads.add_thread(WatcherThread(q))
-    threads.add_thread(HandlerThread(q))
+    threads.add_thread(WatcherThread(watcher, queues, checkpointer))
+    for i, q in enumerate(queues):
+        threads.add_thread(HandlerThread(i, q, initial_sync, checkpointer))
     threads.start_all()
     threads.wait_any()
 
 
 class WatcherThread(SupervisedThread):
-    def __init__(self, queue):
+    """
+    Partitions events by pod uid, so that events of one pod are handled in order by the same worker.
+    Waits when worker queue is full.
+    """
+
+    def __init__(self, watcher, queues, checkpointer):
         super().__init__()
-        self.queue = queue
+        self.watcher = watcher
+        self.queues = queues
+        self.checkpointer = checkpointer
 
     def run_supervised(self):
-        v1 = kubernetes.client.CoreV1Api()
-        for event_type, pod in KubeWatcher(v1.list_pod_for_all_namespaces):
-            self.queue.put((event_type, pod))
+        for event_type, pod in self.watcher:
+            instrumentation.EVENTS.labels(collector='pods', type=event_type.name).inc()
+            if event_type == WatchEventType.DONE_INITIAL:
+                # uids of all pods after listing, or None when watch is resumed and deletions come as events
+                alive_uids = None if pod is RESUMED else set(self.watcher.db)
+                item = (event_type, alive_uids, time.monotonic())
+                for partition, q in enumerate(self.queues):
+                    q.put(item)
+                    self.checkpointer.queued(partition)
+            else:
+                partition = hash(pod.metadata.uid) % len(self.queues)
+                self.queues[partition].put((event_type, pod, time.monotonic()))
+                self.checkpointer.queued(partition)
+            self.checkpointer.checkpoint()
+
+
+class InitialSync:
+    """
+    Coordinates initial sync of handler workers. Owner cache is preloaded once for all workers, then each worker
+    syncs pods of its partition, and then pods missing in the listing are marked as gone.
+    Workers wait for each other, so none of them writes new pods before the cleanup.
+    """
+
+    def __init__(self, workers):
+        self.pending = 0
+        self.alive_uids = None
+        self.lock = threading.Lock()
+        self.preloaded = threading.Barrier(workers, action=self.preload)
+        self.synced = threading.Barrier(workers, action=self.cleanup)
+
+    def preload(self):
+        if not self.pending:
+            return
+        try:
+            owner_cache.preload()
+        except Exception:
+            log.exception('Failed to preload owners')
+
+    def cleanup(self):
+        owner_cache.clear_preloaded()
+        self.pending = 0
+        if self.alive_uids is None:
+            return
+        try:
+            with transaction.atomic():
+                bulk.create_temp_table('kra_initial_pods', 'uid uuid PRIMARY KEY', self.alive_uids)
+                cleanup_gone_pods('kra_initial_pods')
+        except Exception:
+            log.exception('Failed to cleanup gone pods')
+        self.alive_uids = None
+
+    def run(self, pods, alive_uids):
+        """
+        :param alive_uids: uids of all listed pods, or None if there was no listing
+        :return: uids of pods, which are synced completely
+        """
+        with self.lock:
+            self.pending += len(pods)
+            self.alive_uids = alive_uids
+        self.preloaded.wait()
+        try:
+            return sync_pods([pod for pod in pods.values() if pod.status.start_time is not None])
+        finally:
+            self.synced.wait()
 
 
 class HandlerThread(SupervisedThread):
-    def __init__(self, queue):
+    def __init__(self, partition, queue, initial_sync, checkpointer):
         super().__init__()
+        self.partition = partition
         self.queue = queue
-        self.initial_pods = set()
+        self.initial_sync = initial_sync
+        self.checkpointer = checkpointer
+        self.initial_pods = {}
+        self.fingerprints = {}
         self.handle = self.handle_initial_event
 
     def run_supervised(self):
         while True:
-            event_type, pod = self.queue.get()
+            event_type, obj, queued_at = self.queue.get()
+            instrumentation.EVENT_AGE.labels(collector='pods').observe(time.monotonic() - queued_at)
             try:
-                self.handle(event_type, pod)
+                with instrumentation.EVENT_SECONDS.labels(collector='pods').time():
+                    if event_type == WatchEventType.DONE_INITIAL:
+                        self.handle_initial_sync(obj)
+                    else:
+                        self.handle(event_type, obj)
             except Exception:
-                log.exception('Failed to handle %s on pod %s/%s',
-                              event_type.name, pod.metadata.namespace, pod.metadata.name)
+                if event_type == WatchEventType.DONE_INITIAL:
+                    log.exception('Failed to handle %s', event_type.name)
+                else:
+                    log.exception('Failed to handle %s on pod %s/%s',
+                                  event_type.name, obj.metadata.namespace, obj.metadata.name)
+            finally:
+                self.checkpointer.handled(self.partition)
 
     def handle_initial_event(self, event_type, pod):
-        if event_type == WatchEventType.ADDED:
-            self.initial_pods.add(pod.metadata.uid)
-
-        if event_type == WatchEventType.DONE_INITIAL:
-            self.handle = self.handle_normal_event
-            self.initial_cleanup()
-        else:
+        if event_type == WatchEventType.DELETED:
+            self.initial_pods.pop(pod.metadata.uid, None)
             self.handle_normal_event(event_type, pod)
+        else:
+            self.initial_pods[pod.metadata.uid] = pod
 
     @retry_on_connection_close()
     def handle_normal_event(self, event_type, pod):
@@ -75,6 +185,7 @@ class HandlerThread(SupervisedThread):
             self.handle_delete(pod)
 
     def handle_delete(self, pod):
+        self.fingerprints.pop(pod.metadata.uid, None)
         now = timezone.now()
         models.Pod.objects.filter(uid=pod.metadata.uid, gone_at=None).update(gone_at=now)
         models.Container.objects.filter(pod__uid=pod.metadata.uid, finished_at=None).update(finished_at=now)
@@ -83,21 +194,148 @@ class HandlerThread(SupervisedThread):
         if pod.status.start_time is None:
             # Pod is creating, and not started yet
             return
-        update_pod(pod)
 
-    def initial_cleanup(self):
-        now = timezone.now()
-        pod_qs = models.Pod.objects.filter(gone_at=None).exclude(uid__in=self.initial_pods)
-        count = pod_qs.update(gone_at=now)
-        log.info('Marked %d pods as gone', count)
-        container_qs = models.Container.objects.filter(finished_at=None).exclude(pod__uid__in=self.initial_pods)
-        count = container_qs.update(finished_at=now)
-        log.info('Marked %d containers as finished', count)
-        del self.initial_pods
+        fingerprint = get_pod_fingerprint(pod)
+        if self.fingerprints.get(pod.metadata.uid) == fingerprint:
+            instrumentation.POD_UPDATES.labels(result='skipped').inc()
+            return
+
+        self.fingerprints.pop(pod.metadata.uid, None)
+        if update_pod(pod):
+            self.fingerprints[pod.metadata.uid] = fingerprint
+        instrumentation.POD_UPDATES.labels(result='written').inc()
+
+    def handle_initial_sync(self, alive_uids):
+        pods = self.initial_pods
+        self.initial_pods = {}
+        self.handle = self.handle_normal_event
+        if pods:
+            log.info('Syncing %d pods', len(pods))
+
+        with instrumentation.DB_WRITE_SECONDS.labels(operation='initial_sync').time():
+            try:
+                complete_uids = self.initial_sync.run(pods, alive_uids)
+            except Exception:
+                log.exception('Failed to sync pods in bulk, updating one by one')
+                complete_uids = []
+                for pod in pods.values():
+                    try:
+                        self.handle_update(pod)
+                    except Exception:
+                        log.exception('Failed to update pod %s/%s', pod.metadata.namespace, pod.metadata.name)
+            else:
+                instrumentation.POD_UPDATES.labels(result='written').inc(len(complete_uids))
+
+        for uid in complete_uids:
+            self.fingerprints[uid] = get_pod_fingerprint(pods[uid])
+
+
+def sync_pods(pods):
+    """
+    Bulk version of update_pod for initial listing.
+    :return: uids of pods, which workloads are resolved
+    """
+    resolved = [(pod,) + get_workload_data(pod) for pod in pods]
+
+    workloads = {}
+    for pod, workload_data, _ in resolved:
+        if workload_data is not None and workload_data is not UNKNOWN:
+            workloads[(workload_data['kind'], workload_data['namespace'], workload_data['name'])] = workload_data
+    workload_ids = {
+        (models.WorkloadKind(kind), namespace, name): id
+        for id, kind, namespace, name in bulk.upsert(
+            # sorted, so that concurrent upserts lock rows in the same order
+            models.Workload, [workloads[key] for key in sorted(workloads)],
+            conflict_fields=('kind', 'namespace', 'name'), update_fields=('affinity',),
+            returning=('id', 'kind', 'namespace', 'name'))
+    }
+
+    # pods with unresolved workload keep workload they have
+    with_workload = []
+    without_workload = []
+    for pod, workload_data, _ in resolved:
+        data = get_pod_data(pod)
+        if workload_data is UNKNOWN:
+            without_workload.append(data)
+        else:
+            if workload_data is not None:
+                workload_key = (workload_data['kind'], workload_data['namespace'], workload_data['name'])
+                data['workload_id'] = workload_ids[workload_key]
+            with_workload.append(data)
+
+    pod_fields = ('namespace', 'name', 'spec_hash', 'started_at', 'gone_at')
+    pod_ids = dict(bulk.upsert(models.Pod, with_workload, conflict_fields=('uid',),
+                               update_fields=pod_fields + ('workload',), returning=('uid', 'id')))
+    pod_ids.update(bulk.upsert(models.Pod, without_workload, conflict_fields=('uid',),
+                               update_fields=pod_fields, returning=('uid', 'id')))
+
+    # like update_or_create in update_containers, resources missing in spec don't overwrite stored ones,
+    # so containers are grouped by present resource fields
+    containers = defaultdict(list)
+    container_count = 0
+    for pod, _, _ in resolved:
+        for name, data in get_containers_data(pod).items():
+            if data.get('runtime_id') and data.get('started_at'):
+                data['pod_id'] = pod_ids[uuid.UUID(pod.metadata.uid)]
+                containers[tuple(f for f in CONTAINER_RESOURCE_FIELDS if f in data)].append(data)
+                container_count += 1
+    for resource_fields, rows in containers.items():
+        bulk.upsert(models.Container, rows, conflict_fields=('pod', 'runtime_id'),
+                    update_fields=('name', 'started_at', 'finished_at') + resource_fields)
+    log.info('Synced %d workloads, %d pods, %d containers', len(workloads), len(pod_ids), container_count)
+
+    return [pod.metadata.uid for pod, _, complete in resolved if complete]
+
+
+def cleanup_gone_pods(alive_table):
+    """
+    Marks pods missing in `alive_table` as gone, and their containers as finished.
+    """
+    now = timezone.now()
+    pod_table = models.Pod._meta.db_table
+    container_table = models.Container._meta.db_table
+    with connection.cursor() as c:
+        c.execute(f'''
+            UPDATE {pod_table} p SET gone_at = %s
+            WHERE gone_at IS NULL AND NOT EXISTS (SELECT 1 FROM {alive_table} a WHERE a.uid = p.uid)
+        ''', [now])
+        log.info('Marked %d pods as gone', c.rowcount)
+        c.execute(f'''
+            UPDATE {container_table} c SET finished_at = %s
+            FROM {pod_table} p
+            WHERE c.pod_id = p.id AND c.finished_at IS NULL
+                AND NOT EXISTS (SELECT 1 FROM {alive_table} a WHERE a.uid = p.uid)
+        ''', [now])
+        log.info('Marked %d containers as finished', c.rowcount)
 
 
 def update_pod(pod):
-    data = {
+    """
+    :return: False if workload resolution failed, and update should be repeated
+    """
+    data = get_pod_data(pod)
+    workload_data, complete = get_workload_data(pod)
+    if workload_data is None:
+        data['workload'] = None
+    elif workload_data is not UNKNOWN:
+        data['workload'], _ = models.Workload.objects.update_or_create(
+            kind=workload_data['kind'],
+            namespace=workload_data['namespace'],
+            name=workload_data['name'],
+            defaults={
+                'affinity': workload_data['affinity'],
+            }
+        )
+
+    uid = data.pop('uid')
+    mypod, _ = models.Pod.objects.update_or_create(uid=uid, defaults=data)
+    update_containers(pod, mypod)
+    return complete
+
+
+def get_pod_data(pod):
+    return {
+        'uid': pod.metadata.uid,
         'namespace': pod.metadata.namespace,
         'name': pod.metadata.name,
         'spec_hash': get_pod_spec_hash(pod),
@@ -105,24 +343,24 @@ def update_pod(pod):
         'gone_at': None,
     }
 
-    try:
-        try:
-            data['workload'] = get_workload_from_pod(pod)
-        except kubernetes.client.rest.ApiException as e:
-            if e.status == 404:
-                log.info('Failed to get workload for pod %s/%s: Not Found',
-                         pod.metadata.namespace, pod.metadata.name)
-            else:
-                raise e
-    except Exception:
-        log.warning('Failed to get workload for pod %s/%s',
-                    pod.metadata.namespace, pod.metadata.name, exc_info=True)
 
-    mypod, _ = models.Pod.objects.update_or_create(uid=pod.metadata.uid, defaults=data)
-    update_containers(pod, mypod)
+def update_containers(pod, mypod):
+    for name, data in get_containers_data(pod).items():
+        runtime_id = data.pop('runtime_id', None)
+        if not runtime_id:
+            log.info('No runtime_id for container %s in pod %s/%s', name, pod.metadata.namespace, pod.metadata.name)
+            continue
+        if not data.get('started_at'):
+            log.info('No started_at for container %s in pod %s/%s', name, pod.metadata.namespace, pod.metadata.name)
+
+        try:
+            c, _ = models.Container.objects.update_or_create(pod=mypod, runtime_id=runtime_id, defaults=data)
+        except IntegrityError as err:
+            if data.get('started_at'):
+                raise err
 
 
-def update_containers(pod, mypod):
+def get_containers_data(pod):
     mycontainers = {}
 
     for container in pod.spec.containers:
@@ -147,23 +385,32 @@ def update_containers(pod, mypod):
         mycontainers[container_status.name]['started_at'] = started_at
         mycontainers[container_status.name]['finished_at'] = finished_at
 
-    for name, data in mycontainers.items():
-        runtime_id = data.pop('runtime_id', None)
-        if not runtime_id:
-            log.info('No runtime_id for container %s in pod %s/%s', name, pod.metadata.namespace, pod.metadata.name)
-            continue
-        if not data.get('started_at'):
-            log.info('No started_at for container %s in pod %s/%s', name, pod.metadata.namespace, pod.metadata.name)
+    return mycontainers
+
 
+def get_workload_data(pod):
+    """
+    :return: tuple (data, complete), where data is None for pods without workload, or UNKNOWN if workload
+             resolution failed; complete is False if resolution should be repeated
+    """
+    try:
         try:
-            c, _ = models.Container.objects.update_or_create(pod=mypod, runtime_id=runtime_id, defaults=data)
-        except IntegrityError as err:
-            if data.get('started_at'):
-                raise err
+            return get_workload_fields(pod), True
+        except kubernetes.client.rest.ApiException as e:
+            if e.status == 404:
+                log.info('Failed to get workload for pod %s/%s: Not Found',
+                         pod.metadata.namespace, pod.metadata.name)
+                return UNKNOWN, True
+            else:
+                raise e
+    except Exception:
+        log.warning('Failed to get workload for pod %s/%s',
+                    pod.metadata.namespace, pod.metadata.name, exc_info=True)
+        return UNKNOWN, False
 
 
-def get_workload_from_pod(pod):
-    owner = get_owner_recursive(pod)
+def get_workload_fields(pod):
+    owner = owner_cache.get_owner(pod)
     if owner is None:
         return None
     kind = models.WorkloadKind[owner.kind]
@@ -173,15 +420,12 @@ def get_workload_from_pod(pod):
     else:
         affinity = get_affinity_from_pod(pod)
 
-    wl, _ = models.Workload.objects.update_or_create(
-        kind=kind,
-        namespace=pod.metadata.namespace,
-        name=owner.metadata.name,
-        defaults={
-            'affinity': affinity,
-        }
-    )
-    return wl
+    return {
+        'kind': kind,
+        'namespace': pod.metadata.namespace,
+        'name': owner.name,
+        'affinity': affinity,
+    }
 
 
 def get_affinity_from_pod(pod):
@@ -196,32 +440,32 @@ def get_affinity_from_pod(pod):
     return affinity or None
 
 
-def get_owner_recursive(obj):
-    if not obj.metadata.owner_references:
-        return None
-
-    for ref in obj.metadata.owner_references:
-        if not ref.controller:
-            continue
-
-        read_func = kind_to_read_func(ref.kind)
-        owner = read_func(ref.name, obj.metadata.namespace)
-        if owner is None:
-            return None
-
-        superowner = get_owner_recursive(owner)
-        if superowner is not None:
-            return superowner
-
-        return owner
-
-    return None
-
-
-def kind_to_read_func(kind):
-    if kind == 'Node':
-        return lambda name, ns: None
-    return kube.read_funcs[models.WorkloadKind[kind]]
+def get_pod_fingerprint(pod):
+    """
+    Hash of pod fields, which are persisted by update_pod and update_containers.
+    Affinity and node selector are not included, because they are immutable.
+    """
+    ref = get_controller_ref(pod)
+    return hash((
+        pod.metadata.namespace,
+        pod.metadata.name,
+        get_pod_spec_hash(pod),
+        pod.status.start_time,
+        ref and ref.uid,
+        tuple((c.name, tuple(sorted(kube.get_container_resources(c).items()))) for c in pod.spec.containers),
+        tuple(_get_container_status_fingerprint(s) for s in pod.status.container_statuses or []),
+    ))
+
+
+def _get_container_status_fingerprint(container_status):
+    running = container_status.state.running
+    terminated = container_status.state.terminated
+    return (
+        container_status.name,
+        container_status.container_id,
+        running and running.started_at,
+        terminated and (terminated.started_at, terminated.finished_at, terminated.container_id),
+    )
 
 
 def get_pod_spec_hash(pod):
@@ -0,0 +1,152 @@
+"""
+Compact records of watched objects, decoded from raw JSON of API responses.
+
+Records have the same attribute paths as kubernetes.client models (e.g. pod.status.container_statuses[0].state),
+but only for fields read by collectors, so that they are drop-in replacements of V1Pod and V1Node there.
+"""
+
+import sys
+from datetime import datetime
+
+import dateutil.parser
+import kubernetes
+
+_api_client = kubernetes.client.ApiClient()
+
+
+class Record:
+    __slots__ = ()
+
+    def __init__(self, *args):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class ObjectMeta(Record):
+    __slots__ = ('uid', 'name', 'namespace', 'resource_version', 'labels', 'owner_references')
+
+
+class OwnerReference(Record):
+    __slots__ = ('kind', 'name', 'uid', 'controller')
+
+
+class Pod(Record):
+    __slots__ = ('metadata', 'spec', 'status')
+
+
+class PodSpec(Record):
+    __slots__ = ('containers', 'affinity', 'node_selector')
+
+
+class Container(Record):
+    __slots__ = ('name', 'resources')
+
+
+class ResourceRequirements(Record):
+    __slots__ = ('limits', 'requests')
+
+
+class PodStatus(Record):
+    __slots__ = ('start_time', 'container_statuses')
+
+
+class ContainerStatus(Record):
+    __slots__ = ('name', 'container_id', 'state')
+
+
+class ContainerState(Record):
+    __slots__ = ('running', 'terminated')
+
+
+class ContainerStateRunning(Record):
+    __slots__ = ('started_at',)
+
+
+class ContainerStateTerminated(Record):
+    __slots__ = ('started_at', 'finished_at', 'container_id')
+
+
+class Node(Record):
+    __slots__ = ('metadata',)
+
+
+def decode_pod(data):
+    spec = data.get('spec') or {}
+    status = data.get('status') or {}
+    affinity = spec.get('affinity')
+    if affinity:
+        # rare and persisted as is, so decoded to model to keep the format of V1Affinity.to_dict()
+        affinity = _api_client._ApiClient__deserialize(affinity, 'V1Affinity')
+    return Pod(
+        decode_metadata(data['metadata']),
+        PodSpec(
+            [_decode_container(c) for c in spec.get('containers') or []],
+            affinity,
+            spec.get('nodeSelector'),
+        ),
+        PodStatus(
+            parse_time(status.get('startTime')),
+            [_decode_container_status(s) for s in status.get('containerStatuses') or []] or None,
+        ),
+    )
+
+
+def decode_node(data):
+    return Node(decode_metadata(data['metadata']))
+
+
+def decode_metadata(data):
+    labels = data.get('labels')
+    if labels:
+        labels = {sys.intern(k): v for k, v in labels.items()}
+    owner_references = data.get('ownerReferences')
+    if owner_references:
+        owner_references = [
+            OwnerReference(sys.intern(ref['kind']), ref['name'], ref['uid'], ref.get('controller'))
+            for ref in owner_references
+        ]
+    namespace = data.get('namespace')
+    return ObjectMeta(
+        data['uid'],
+        data['name'],
+        namespace and sys.intern(namespace),
+        data.get('resourceVersion'),
+        labels,
+        owner_references,
+    )
+
+
+def _decode_container(data):
+    resources = data.get('resources')
+    if resources:
+        resources = ResourceRequirements(resources.get('limits'), resources.get('requests'))
+    return Container(data['name'], resources)
+
+
+def _decode_container_status(data):
+    state = data.get('state') or {}
+    running = state.get('running')
+    terminated = state.get('terminated')
+    if running is not None:
+        running = ContainerStateRunning(parse_time(running.get('startedAt')))
+    if terminated is not None:
+        terminated = ContainerStateTerminated(
+            parse_time(terminated.get('startedAt')),
+            parse_time(terminated.get('finishedAt')),
+            terminated.get('containerID'),
+        )
+    return ContainerStatus(data['name'], data.get('containerID'), ContainerState(running, terminated))
+
+
+def parse_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        # e.g. nanoseconds
+        return dateutil.parser.isoparse(value)
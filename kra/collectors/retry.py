@@ -0,0 +1,51 @@
+import heapq
+import itertools
+import threading
+import time
+
+from utils.threading import SupervisedThread
+
+
+class RetryThread(SupervisedThread):
+    """
+    Delay queue on a heap, one thread for all pending retries.
+    Due items are passed to `target`, e.g. put back to handler queue.
+
+    Delay of attempt N (starting from 1 for the first retry) is `base_delay` * 2^(N-1), but not more than `max_delay`.
+    """
+
+    def __init__(self, target, base_delay, max_delay):
+        super().__init__()
+        self.target = target
+        self.base_delay = base_delay.total_seconds()
+        self.max_delay = max_delay.total_seconds()
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+
+    def get_delay(self, attempt):
+        return min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+
+    def schedule(self, item, attempt):
+        """
+        :return: delay in seconds
+        """
+        delay = self.get_delay(attempt)
+        with self.cond:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.seq), item))
+            self.cond.notify()
+        return delay
+
+    def pending(self):
+        return len(self.heap)
+
+    def run_supervised(self):
+        while True:
+            with self.cond:
+                while True:
+                    timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.cond.wait(timeout)
+                _, _, item = heapq.heappop(self.heap)
+            self.target(item)
@@ -0,0 +1,50 @@
+import random
+
+
+class NodeScheduler:
+    """
+    Keeps next due time for each node.
+    Nodes get random phase within interval when scheduled, so that scrapes are spread evenly over time,
+    then they are due exactly each interval, so that samples of each node are evenly spaced.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval.total_seconds()
+        self.due = {}
+
+    def sync(self, node_names, now):
+        """
+        Schedules new nodes and drops gone ones.
+        :return: (added, removed) node names
+        """
+        node_names = set(node_names)
+        added = node_names - self.due.keys()
+        removed = self.due.keys() - node_names
+        for node_name in added:
+            self.due[node_name] = now + random.uniform(0, self.interval)
+        for node_name in removed:
+            del self.due[node_name]
+        return added, removed
+
+    def pop_due(self, now):
+        """
+        Reschedules due nodes to the next interval.
+        :return: list of (node_name, due time), due time is the slot the scrape was planned for
+        """
+        result = []
+        for node_name, due in self.due.items():
+            if due > now:
+                continue
+            result.append((node_name, due))
+            next_due = due + self.interval
+            if next_due <= now:
+                # overrun, skip missed intervals keeping the phase
+                next_due += (now - next_due) // self.interval * self.interval + self.interval
+            self.due[node_name] = next_due
+        return result
+
+    def is_scheduled(self, node_name):
+        return node_name in self.due
+
+    def next_due(self):
+        return min(self.due.values(), default=None)
@@ -0,0 +1,132 @@
+import time
+import bisect
+import socket
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+import kubernetes
+import kubernetes.client.rest
+from django.conf import settings
+from django.utils import timezone
+
+from utils.threading import SupervisedThread
+
+log = logging.getLogger(__name__)
+
+LEASE_LABEL = 'kra.smp.io/shard-group'
+
+
+def get_shard(group):
+    """
+    :return: StaticShard or LeaseShard, configured by settings
+    """
+    if settings.METRICS_SHARD_LEASE_NAMESPACE:
+        return LeaseShard(settings.METRICS_SHARD_LEASE_NAMESPACE, group)
+
+    index = settings.METRICS_SHARD_INDEX
+    if index is None:
+        if settings.METRICS_SHARD_COUNT > 1:
+            index = int(socket.gethostname().rsplit('-', 1)[-1])
+        else:
+            index = 0
+    return StaticShard(index, settings.METRICS_SHARD_COUNT)
+
+
+class HashRing:
+    """
+    Consistent hash ring, so that only ~1/N of keys move when a member joins or leaves
+    """
+
+    def __init__(self, members, vnodes=256):
+        self.members = frozenset(members)
+        self.ring = sorted((_hash(f'{member}#{i}'), member) for member in self.members for i in range(vnodes))
+        self.hashes = [h for h, _ in self.ring]
+
+    def get(self, key):
+        if not self.ring:
+            return None
+        idx = bisect.bisect(self.hashes, _hash(key)) % len(self.ring)
+        return self.ring[idx][1]
+
+
+class StaticShard:
+    """
+    Fixed shard membership, e.g. StatefulSet with replica ordinal as shard index
+    """
+
+    def __init__(self, index, count):
+        self.me = str(index)
+        self.ring = HashRing(str(i) for i in range(count))
+
+    def owns(self, node_name):
+        return self.ring.get(node_name) == self.me
+
+
+class LeaseShard(SupervisedThread):
+    """
+    Dynamic shard membership, backed by coordination.k8s.io Leases.
+    Each replica renews its own lease, live leases of the group form the hash ring.
+    """
+
+    def __init__(self, namespace, group, identity=None, lease_duration=timedelta(seconds=30)):
+        super().__init__()
+        self.namespace = namespace
+        self.group = group
+        self.me = identity or socket.gethostname()
+        self.lease_duration = lease_duration
+        self.ring = HashRing([self.me])
+        self.ready = threading.Event()
+        self.api = kubernetes.client.CoordinationV1Api()
+
+    def owns(self, node_name):
+        self.ready.wait()
+        return self.ring.get(node_name) == self.me
+
+    def run_supervised(self):
+        while True:
+            self.renew()
+            self.update_members()
+            self.ready.set()
+            time.sleep(self.lease_duration.total_seconds() / 3)
+
+    def renew(self):
+        lease_name = f'{self.group}-{self.me}'
+        spec = {
+            'holderIdentity': self.me,
+            'leaseDurationSeconds': int(self.lease_duration.total_seconds()),
+            'renewTime': timezone.now(),
+        }
+        try:
+            self.api.patch_namespaced_lease(lease_name, self.namespace, {'spec': spec})
+        except kubernetes.client.rest.ApiException as e:
+            if e.status != 404:
+                raise e
+            self.api.create_namespaced_lease(self.namespace, {
+                'metadata': {
+                    'name': lease_name,
+                    'labels': {LEASE_LABEL: self.group},
+                },
+                'spec': spec,
+            })
+
+    def update_members(self):
+        now = timezone.now()
+        leases = self.api.list_namespaced_lease(self.namespace, label_selector=f'{LEASE_LABEL}={self.group}')
+        members = {self.me}
+        for lease in leases.items:
+            spec = lease.spec
+            if not spec.holder_identity or not spec.renew_time:
+                continue
+            if spec.renew_time + timedelta(seconds=spec.lease_duration_seconds or 0) < now:
+                continue
+            members.add(spec.holder_identity)
+
+        if members != self.ring.members:
+            log.info('Shard members changed: %s', ', '.join(sorted(members)))
+            self.ring = HashRing(members)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from django.db import DatabaseError, InterfaceError, OperationalError
+
+from utils.threading import SupervisedThread
+from utils.django.db import fix_long_connections
+
+from kra import models
+from kra.analytics.container import reset_containers_summary
+from kra.collectors import instrumentation
+
+log = logging.getLogger(__name__)
+
+# db is unavailable, rows are spooled and retried
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+SEGMENT_SUFFIX = '.jsonl'
+OFFSET_SUFFIX = '.offset'
+
+
+class Spool:
+    """
+    Bounded in-memory queue of ResourceUsage rows, which overflows to append-only segment files on disk.
+    Rows are tuples (container_id, measured_at, memory_mi, cpu_m_seconds).
+
+    Without `path` rows which don't fit into the queue are dropped.
+    With `path` spooled rows survive restarts. When spool size reaches `max_bytes` oldest segments are dropped
+    with drop_policy='oldest', or new rows are dropped with drop_policy='newest'.
+    """
+
+    def __init__(self, path=None, queue_size=1000, max_bytes=1024 ** 3, segment_bytes=16 * 1024 ** 2,
+                 drop_policy='oldest'):
+        if drop_policy not in ('oldest', 'newest'):
+            raise ValueError(f'Unknown drop policy "{drop_policy}"')
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.drop_policy = drop_policy
+        self.lock = threading.Lock()
+        self.segment = None
+        self.seq = 0
+        self.dropped = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self.seq = max((_segment_seq(p) for p in self.segments()), default=0)
+
+    def put(self, rows):
+        """
+        Never blocks, rows are spilled to disk when queue is full.
+        """
+        if not rows:
+            return
+        try:
+            self.queue.put_nowait(rows)
+        except queue.Full:
+            self.spill(rows)
+
+    def get(self, max_rows, timeout):
+        """
+        :return: list of up to ~max_rows rows, waits up to `timeout` seconds for the first batch
+        """
+        try:
+            rows = list(self.queue.get(timeout=timeout))
+        except queue.Empty:
+            return []
+        while len(rows) < max_rows:
+            try:
+                rows.extend(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def flush(self):
+        """
+        Spills queued rows to disk, e.g. on shutdown.
+        """
+        while True:
+            try:
+                self.spill(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+    def spill(self, rows):
+        if not self.path:
+            self.drop(len(rows), 'no spool configured')
+            return
+
+        line = json.dumps([[cid, measured_at.isoformat(), mem, cpu] for cid, measured_at, mem, cpu in rows]) + '\n'
+        with self.lock:
+            if not self._make_room(len(line)):
+                self.drop(len(rows), 'spool is full')
+                return
+            if self.segment is None:
+                self.seq += 1
+                self.segment = open(os.path.join(self.path, f'{self.seq:010d}{SEGMENT_SUFFIX}'), 'a')
+            self.segment.write(line)
+            self.segment.flush()
+            instrumentation.SAMPLES.labels(state='spooled').inc(len(rows))
+            if self.segment.tell() >= self.segment_bytes:
+                self._close_segment()
+
+    def drop(self, count, reason):
+        """
+        Counts dropped rows, e.g. the ones which don't fit into spool or are rejected by db.
+        """
+        self.dropped += count
+        instrumentation.SAMPLES.labels(state='dropped').inc(count)
+        log.warning('Dropped %d samples: %s', count, reason)
+
+    def size(self):
+        if not self.path:
+            return 0
+        return sum(_getsize(p) for p in self.segments())
+
+    def has_backlog(self):
+        return bool(self.path) and bool(self.segments())
+
+    def replay(self, write, batch_rows):
+        """
+        Passes spooled rows to `write` in batches, oldest first, and removes replayed segments.
+        Replay offset is saved after each batch, so a restart repeats at most one batch.
+        :return: number of replayed rows
+        """
+        with self.lock:
+            self._close_segment()
+            segments = self.segments()
+
+        count = 0
+        for segment_path in segments:
+            try:
+                count += self._replay_segment(segment_path, write, batch_rows)
+            except FileNotFoundError:
+                # dropped meanwhile
+                continue
+            with self.lock:
+                _remove(segment_path)
+                _remove(segment_path + OFFSET_SUFFIX)
+        return count
+
+    def segments(self):
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(SEGMENT_SUFFIX))
+
+    def _replay_segment(self, segment_path, write, batch_rows):
+        offset_path = segment_path + OFFSET_SUFFIX
+        try:
+            with open(offset_path) as offset_file:
+                offset = int(offset_file.read() or 0)
+        except FileNotFoundError:
+            offset = 0
+
+        count = 0
+        with open(segment_path) as segment_file:
+            segment_file.seek(offset)
+            rows = []
+            while True:
+                line = segment_file.readline()
+                if line.endswith('\n'):
+                    rows.extend((cid, datetime.fromisoformat(measured_at), mem, cpu)
+                                for cid, measured_at, mem, cpu in json.loads(line))
+                if rows and (len(rows) >= batch_rows or not line.endswith('\n')):
+                    write(rows)
+                    count += len(rows)
+                    rows = []
+                    with open(offset_path, 'w') as offset_file:
+                        offset_file.write(str(segment_file.tell()))
+                if not line.endswith('\n'):
+                    # EOF or incomplete last line after crash
+                    break
+        return count
+
+    def _make_room(self, size):
+        segments = self.segments()
+        total = self.size()
+        while total + size > self.max_bytes:
+            if self.drop_policy == 'newest' or not segments:
+                return False
+            oldest = segments.pop(0)
+            if self.segment is not None and self.segment.name == oldest:
+                self._close_segment()
+            total -= os.path.getsize(oldest)
+            log.warning('Spool is full, dropping segment %s', oldest)
+            _remove(oldest)
+            _remove(oldest + OFFSET_SUFFIX)
+        return True
+
+    def _close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+
+class SpoolWriterThread(SupervisedThread):
+    """
+    Writes queued rows to db, spools them on failure and replays the spool when db is available.
+    Only transient errors (see TRANSIENT_ERRORS) are retried, rows rejected by db are dropped.
+    """
+
+    def __init__(self, spool, batch_rows=5000, retry_interval=timedelta(seconds=10)):
+        super().__init__()
+        self.spool = spool
+        self.batch_rows = batch_rows
+        self.retry_interval = retry_interval
+
+    def run_supervised(self):
+        while True:
+            rows = self.spool.get(self.batch_rows, timeout=1)
+            fix_long_connections()
+
+            if rows:
+                try:
+                    self.write(rows)
+                except TRANSIENT_ERRORS:
+                    log.exception('Failed to write %d samples, spooling', len(rows))
+                    self.spool.spill(rows)
+                    time.sleep(self.retry_interval.total_seconds())
+                    continue
+
+            if self.spool.has_backlog():
+                try:
+                    count = self.spool.replay(self.write, self.batch_rows)
+                except TRANSIENT_ERRORS:
+                    log.exception('Failed to replay spool')
+                    time.sleep(self.retry_interval.total_seconds())
+                else:
+                    log.info('Replayed %d spooled samples', count)
+
+    def write(self, rows):
+        """
+        Raises only transient errors. If the batch is rejected by db, e.g. because some container was deleted
+        meanwhile by cleanup or pod GC, rows are written one by one and rejected ones are dropped.
+        """
+        try:
+            self.insert(rows)
+        except TRANSIENT_ERRORS:
+            raise
+        except DatabaseError:
+            log.warning('Batch of %d samples is rejected, writing one by one', len(rows), exc_info=True)
+        else:
+            self.reset_summaries(rows)
+            return
+
+        written = []
+        for row in rows:
+            try:
+                self.insert([row])
+            except TRANSIENT_ERRORS:
+                raise
+            except DatabaseError as err:
+                log.debug('Sample %s is rejected: %s', row, err)
+            else:
+                written.append(row)
+        if len(written) < len(rows):
+            self.spool.drop(len(rows) - len(written), 'rejected by db')
+        self.reset_summaries(written)
+
+    def insert(self, rows):
+        with instrumentation.DB_WRITE_SECONDS.labels(operation='resource_usage').time():
+            models.ResourceUsage.objects.bulk_create(
+                models.ResourceUsage(container_id=cid, measured_at=measured_at, memory_mi=mem, cpu_m_seconds=cpu)
+                for cid, measured_at, mem, cpu in rows
+            )
+        instrumentation.SAMPLES.labels(state='written').inc(len(rows))
+
+    def reset_summaries(self, rows):
+        """
+        Resets aggregates advanced past written samples, e.g. replayed from spool (see kra.analytics.container).
+        Rows are already written, so errors are only logged.
+        """
+        try:
+            count = reset_containers_summary(rows)
+        except Exception:
+            log.exception('Failed to reset summaries of containers with late samples')
+            return
+        if count:
+            log.info('Reset summaries of %d containers with late samples', count)
+
+
+def _segment_seq(segment_path):
+    return int(os.path.basename(segment_path)[:-len(SEGMENT_SUFFIX)])
+
+
+def _getsize(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        # removed after listing
+        return 0
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,235 @@
+import json
+import time
+import logging
+from collections import deque
+from datetime import timedelta
+
+import kubernetes
+import kubernetes.watch
+import kubernetes.client.rest
+
+from utils.kubernetes.watch import WatchEventType
+from utils.django.db import fix_long_connections
+
+from kra import models
+
+log = logging.getLogger(__name__)
+
+# obj of DONE_INITIAL event, when watch is resumed without listing
+RESUMED = object()
+
+
+class ResourceVersionExpired(Exception):
+    pass
+
+
+class ResumableWatcher:
+    """
+    Watches objects like KubeWatcher, yielding (WatchEventType, obj) and keeping objects in `db` by uid.
+    Last handled resourceVersion is saved by `name` (see Checkpointer), and watch is resumed from it on restart,
+    so that objects are not listed again.
+
+    With name=None resourceVersion is not saved, and objects are always listed on start.
+
+    With `decode` function objects are decoded from raw JSON by it (see kra.collectors.records), instead of
+    deserialization to kubernetes.client models.
+
+    DONE_INITIAL is yielded with obj=None after full listing, or with obj=RESUMED right before resumed events.
+    In the latter case events missed while collector was down are yielded by API server, but `db` has only
+    objects seen since then. `resumed` is True if watch is started from saved resourceVersion, even if it's expired
+    and objects are listed (then listed objects may be missed while collector was down too).
+
+    When resourceVersion is expired (410 Gone), objects are listed again. If `db` has all objects, differences
+    are yielded as ADDED, MODIFIED and DELETED events. Otherwise listed objects are yielded as ADDED followed by
+    DONE_INITIAL, like on start without saved resourceVersion.
+    """
+
+    def __init__(self, list_func, name, decode=None, timeout=timedelta(minutes=5), **kwargs):
+        self.list_func = list_func
+        self.name = name
+        self.decode = decode
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.db = {}
+        self.complete = False
+        self.resource_version = None
+        self.saved_version = None
+        self.resumed = False
+
+    def __iter__(self):
+        self.resource_version = self.saved_version = self.load()
+        resumed = self.resumed = self.resource_version is not None
+        if resumed:
+            log.info('Resuming %s watch from resourceVersion %s', self.name, self.resource_version)
+        else:
+            yield from self.relist()
+
+        while True:
+            try:
+                for event_type, obj in self.watch():
+                    if resumed:
+                        resumed = False
+                        yield WatchEventType.DONE_INITIAL, RESUMED
+                    yield event_type, obj
+            except ResourceVersionExpired:
+                log.info('%s watch resourceVersion %s is expired, listing', self.name, self.resource_version)
+                resumed = False
+                yield from self.relist()
+            else:
+                if resumed:
+                    # nothing happened since resourceVersion
+                    resumed = False
+                    yield WatchEventType.DONE_INITIAL, RESUMED
+
+    def relist(self):
+        items, resource_version = self.list()
+        objs = {obj.metadata.uid: obj for obj in items}
+        log.info('Listed %d objects for %s watch', len(objs), self.name)
+        # db is updated in place, as consumers (e.g. metrics collector) keep reference to it
+        old_db = dict(self.db)
+        self.db.clear()
+        self.db.update(objs)
+
+        for uid, obj in old_db.items():
+            if uid not in objs:
+                yield WatchEventType.DELETED, obj
+
+        for uid, obj in objs.items():
+            old = old_db.get(uid) if self.complete else None
+            if old is None:
+                yield WatchEventType.ADDED, obj
+            elif old.metadata.resource_version != obj.metadata.resource_version:
+                yield WatchEventType.MODIFIED, obj
+
+        # set after all listed objects are yielded, so that it's not saved before they are handled
+        self.resource_version = resource_version
+        if not self.complete:
+            self.complete = True
+            yield WatchEventType.DONE_INITIAL, None
+
+    def list(self):
+        """
+        :return: (objects, resourceVersion)
+        """
+        if self.decode is None:
+            resp = self.list_func(**self.kwargs)
+            return resp.items, resp.metadata.resource_version
+        resp = self.list_func(_preload_content=False, **self.kwargs)
+        try:
+            data = json.loads(resp.data)
+        finally:
+            resp.release_conn()
+        return [self.decode(item) for item in data['items']], data['metadata']['resourceVersion']
+
+    def watch(self):
+        try:
+            for event_type, obj in self.stream():
+                if event_type == 'ERROR':
+                    if obj.get('code') == 410:
+                        raise ResourceVersionExpired()
+                    raise kubernetes.client.rest.ApiException(status=obj.get('code'), reason=obj.get('message'))
+
+                if event_type == 'DELETED':
+                    self.db.pop(obj.metadata.uid, None)
+                else:
+                    self.db[obj.metadata.uid] = obj
+                yield WatchEventType[event_type], obj
+                # set after the event is passed to consumer, so that it's not saved before the event is queued
+                self.resource_version = obj.metadata.resource_version
+        except kubernetes.client.rest.ApiException as e:
+            if e.status == 410:
+                raise ResourceVersionExpired()
+            raise e
+
+    def stream(self):
+        """
+        Yields (event type, obj), where obj of ERROR event is raw Status.
+        """
+        timeout_seconds = int(self.timeout.total_seconds())
+        if self.decode is None:
+            w = kubernetes.watch.Watch()
+            for event in w.stream(self.list_func, resource_version=self.resource_version,
+                                  timeout_seconds=timeout_seconds, **self.kwargs):
+                if event['type'] == 'ERROR':
+                    yield event['type'], event['raw_object']
+                else:
+                    yield event['type'], event['object']
+            return
+
+        resp = self.list_func(watch=True, resource_version=self.resource_version, timeout_seconds=timeout_seconds,
+                              _preload_content=False, **self.kwargs)
+        try:
+            for line in iter_lines(resp):
+                event = json.loads(line)
+                if event['type'] == 'ERROR':
+                    yield event['type'], event['object']
+                else:
+                    yield event['type'], self.decode(event['object'])
+        finally:
+            # partially read chunked response must not be returned to the pool
+            resp.close()
+            resp.release_conn()
+
+    def load(self):
+        if self.name is None:
+            return None
+        return models.WatchState.objects.filter(name=self.name).values_list('resource_version', flat=True).first()
+
+    def save(self, resource_version):
+        if self.name is None or resource_version is None or resource_version == self.saved_version:
+            return
+        models.WatchState.objects.update_or_create(name=self.name, defaults={'resource_version': resource_version})
+        self.saved_version = resource_version
+
+
+class Checkpointer:
+    """
+    Saves resourceVersion of watcher, once all events up to it are handled.
+    Watcher thread calls `queued` after each event put to a partition queue, and `checkpoint` after each watch event.
+    Handler threads call `handled` after each event taken from their partition queue.
+    """
+
+    def __init__(self, watcher, partitions=1, interval=timedelta(seconds=10)):
+        self.watcher = watcher
+        self.interval = interval.total_seconds()
+        self.queued_counts = [0] * partitions
+        self.handled_counts = [0] * partitions
+        self.marks = deque()
+        self.next_mark_at = 0
+
+    def queued(self, partition=0):
+        self.queued_counts[partition] += 1
+
+    def handled(self, partition=0):
+        self.handled_counts[partition] += 1
+
+    def checkpoint(self):
+        now = time.monotonic()
+        if now >= self.next_mark_at:
+            self.marks.append((self.watcher.resource_version, list(self.queued_counts)))
+            self.next_mark_at = now + self.interval
+
+        resource_version = None
+        while self.marks and all(h >= q for h, q in zip(self.handled_counts, self.marks[0][1])):
+            resource_version = self.marks.popleft()[0] or resource_version
+        if resource_version is None:
+            return
+
+        try:
+            fix_long_connections()
+            self.watcher.save(resource_version)
+        except Exception:
+            log.warning('Failed to save resourceVersion of %s watch', self.watcher.name, exc_info=True)
+
+
+def iter_lines(resp):
+    buf = b''
+    for chunk in resp.stream(amt=None, decode_content=False):
+        buf += chunk
+        lines = buf.split(b'\n')
+        buf = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if buf.strip():
+        yield buf
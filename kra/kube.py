@@ -18,6 +18,15 @@ read_funcs = {
     WorkloadKind.Job: api.BatchV1Api().read_namespaced_job,
 }
 
+list_funcs = {
+    WorkloadKind.ReplicaSet: api.AppsV1Api().list_replica_set_for_all_namespaces,
+    WorkloadKind.Deployment: api.AppsV1Api().list_deployment_for_all_namespaces,
+    WorkloadKind.DaemonSet: api.AppsV1Api().list_daemon_set_for_all_namespaces,
+    WorkloadKind.CronJob: api.BatchV1beta1Api().list_cron_job_for_all_namespaces,
+    WorkloadKind.StatefulSet: api.AppsV1Api().list_stateful_set_for_all_namespaces,
+    WorkloadKind.Job: api.BatchV1Api().list_job_for_all_namespaces,
+}
+
 patch_funcs = {
     WorkloadKind.ReplicaSet: api.AppsV1Api().patch_namespaced_replica_set,
     WorkloadKind.Deployment: api.AppsV1Api().patch_namespaced_deployment,
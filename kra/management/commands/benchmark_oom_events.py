@@ -0,0 +1,60 @@
+import time
+import tracemalloc
+
+import kubernetes
+from django.core.management.base import BaseCommand
+
+from kra.collectors.oom import EVENT_SELECTOR
+
+MEBIBYTE = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = 'Compare listing of NodeOOM events with client-side and server-side filtering on current cluster'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs per method')
+
+    def handle(self, *args, **options):
+        v1 = kubernetes.client.CoreV1Api()
+
+        def client_side():
+            events = v1.list_event_for_all_namespaces().items
+            return len(events), [e.metadata.uid for e in events if e.reason == 'NodeOOM']
+
+        def server_side():
+            events = v1.list_event_for_all_namespaces(field_selector=EVENT_SELECTOR).items
+            return len(events), [e.metadata.uid for e in events]
+
+        client_result, client_stats = measure(client_side, options['repeat'])
+        server_result, server_stats = measure(server_side, options['repeat'])
+
+        for name, (received, ooms), (wall, cpu, peak) in (('client-side', client_result, client_stats),
+                                                          ('server-side', server_result, server_stats)):
+            print(f'{name}: {received} events received, {len(ooms)} NodeOOM')
+            print(f'  wall: {wall * 1000:.1f} ms, cpu: {cpu * 1000:.1f} ms, peak memory: {peak / MEBIBYTE:.2f} MiB')
+        print(f'server-side filtering uses {client_stats[1] / max(server_stats[1], 1e-6):.1f}x less cpu '
+              f'and {client_stats[2] / max(server_stats[2], 1):.1f}x less memory')
+        if sorted(client_result[1]) != sorted(server_result[1]):
+            print('WARNING: results differ (events may change between runs)')
+
+
+def measure(func, repeat):
+    """
+    :return: (result, (best wall seconds, best cpu seconds, peak traced memory bytes))
+    """
+    best_wall = best_cpu = None
+    peak = 0
+    result = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = func()
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    return result, (best_wall, best_cpu, peak)
@@ -0,0 +1,72 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from prometheus_client.parser import text_string_to_metric_families
+
+from kra.utils import parse_cgroup
+from kra.collectors.parser import parse_container_samples
+from kra.collectors.metrics import SAMPLE_NAMES
+
+MEBIBYTE = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = 'Compare cadvisor payload parsers on recorded payloads ' \
+           '(kubectl get --raw /api/v1/nodes/NODE/proxy/metrics/cadvisor > FILE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('payloads', nargs='+', metavar='FILE', help='Recorded /metrics/cadvisor output')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of runs per parser')
+
+    def handle(self, *args, **options):
+        for filename in options['payloads']:
+            with open(filename) as payload_file:
+                payload = payload_file.read()
+
+            full_result, full_seconds = measure(parse_full, payload, options['repeat'])
+            selective_result, selective_seconds = measure(parse_selective, payload, options['repeat'])
+
+            print(f'{filename}: {len(payload) / MEBIBYTE:.2f} MiB, {len(selective_result)} containers')
+            print(f'  prometheus_client: {full_seconds * 1000:.1f} ms')
+            print(f'  selective:         {selective_seconds * 1000:.1f} ms '
+                  f'({full_seconds / selective_seconds:.1f}x faster)')
+            if full_result != selective_result:
+                print('  WARNING: results differ')
+
+
+def measure(func, payload, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(payload)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+def parse_selective(payload):
+    data = defaultdict(dict)
+    for sample_name, key, value in parse_container_samples(payload.splitlines(), SAMPLE_NAMES):
+        data[key][sample_name] = value
+    return data
+
+
+def parse_full(payload):
+    """
+    Previous implementation, parsing all metric families
+    """
+    metrics = {family.name: family for family in text_string_to_metric_families(payload)}
+    data = defaultdict(dict)
+    for family_name in ('container_memory_working_set_bytes', 'container_cpu_usage_seconds'):
+        for sample in metrics[family_name].samples:
+            container_name = sample.labels['container']
+            if not container_name or container_name == 'POD':
+                continue
+            pod_uid, container_runtime_id = parse_cgroup(sample.labels['id'])
+            if not pod_uid or '-' not in pod_uid:
+                continue
+            data[pod_uid, container_runtime_id][sample.name] = sample.value
+    return data
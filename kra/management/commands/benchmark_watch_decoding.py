@@ -0,0 +1,70 @@
+import json
+import time
+import resource
+import multiprocessing
+
+import kubernetes
+import kubernetes.watch
+from django.core.management.base import BaseCommand
+
+from kra.collectors import records
+
+KINDS = {
+    'pod': ('V1Pod', records.decode_pod),
+    'node': ('V1Node', records.decode_node),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare decoding of watch events to kubernetes.client models and to compact records ' \
+           'on a recorded listing (kubectl get pods --all-namespaces -o json > FILE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('listing', metavar='FILE', help='Recorded listing in JSON')
+        parser.add_argument('--kind', choices=KINDS.keys(), default='pod')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of passes over the listing')
+
+    def handle(self, *args, **options):
+        with open(options['listing']) as listing_file:
+            items = json.load(listing_file)['items']
+        lines = [json.dumps({'type': 'MODIFIED', 'object': item}) for item in items]
+        print(f'{options["listing"]}: {len(lines)} events, {sum(map(len, lines)) / 1024 / 1024:.2f} MiB')
+
+        # each mode runs in a fresh process, so that peak RSS is not shared
+        ctx = multiprocessing.get_context('fork')
+        results = {}
+        for mode in ('model', 'raw'):
+            with ctx.Pool(1) as pool:
+                results[mode] = pool.apply(run, (mode, options['kind'], lines, options['repeat']))
+            events_per_second, rss_before, rss_after = results[mode]
+            print(f'  {mode:5}: {events_per_second:.0f} events/s, '
+                  f'peak RSS {rss_after / 1024:.1f} MiB (+{(rss_after - rss_before) / 1024:.1f} MiB for decoding)')
+
+        print(f'raw decoding is {results["raw"][0] / results["model"][0]:.1f}x faster')
+
+
+def run(mode, kind, lines, repeat):
+    """
+    Decodes events keeping decoded objects by uid, like watcher db.
+    :return: (events per second, peak RSS in KiB before, peak RSS in KiB after)
+    """
+    return_type, decode = KINDS[kind]
+    if mode == 'model':
+        watch = kubernetes.watch.Watch()
+
+        def decode_event(line):
+            return watch.unmarshal_event(line, return_type)['object']
+    else:
+        def decode_event(line):
+            return decode(json.loads(line)['object'])
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    db = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            obj = decode_event(line)
+            db[obj.metadata.uid] = obj
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return len(lines) * repeat / elapsed, rss_before, rss_after
@@ -0,0 +1,54 @@
+import math
+
+from django.core.management.base import BaseCommand
+
+from kra import models
+from kra.analytics.container import summarize_containers, get_containers_summary
+
+CHECKED_FIELDS = [
+    'since', 'till', 'total_seconds',
+    'max_memory_mi', 'avg_memory_mi', 'stddev_memory_mi',
+    'max_cpu_m', 'avg_cpu_m', 'stddev_cpu_m',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare running aggregates of frozen container summaries with full scan of resource usage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100, help='Number of last finished containers to check')
+        parser.add_argument('--tolerance', type=float, default=1e-6, help='Relative tolerance of float stats')
+
+    def handle(self, *args, **options):
+        # frozen aggregates cover all samples, while running ones lag behind by settle delay
+        container_ids = list(
+            models.ContainerSummary.objects.filter(frozen=True)
+            .order_by('-container__finished_at')
+            .values_list('container_id', flat=True)[:options['limit']]
+        )
+        aggregated = {c.id: c for c in summarize_containers(container_ids)}
+        scanned = {c.id: c for c in get_containers_summary(container_ids)}
+
+        mismatches = 0
+        for container_id in container_ids:
+            a = aggregated.get(container_id)
+            s = scanned.get(container_id)
+            if a is None or s is None:
+                print(f'Container {container_id}: aggregated {a is not None}, scanned {s is not None}')
+                mismatches += 1
+                continue
+            diff = [name for name in CHECKED_FIELDS
+                    if not is_close(getattr(a, name), getattr(s, name), options['tolerance'])]
+            if diff:
+                mismatches += 1
+                print(f'Container {container_id} ({a}):')
+                for name in diff:
+                    print(f'  {name}: aggregated {getattr(a, name)}, scanned {getattr(s, name)}')
+
+        print(f'Checked {len(container_ids)} containers, {mismatches} mismatches')
+
+
+def is_close(a, b, tolerance):
+    if isinstance(a, float) or isinstance(b, float):
+        return math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance)
+    return a == b
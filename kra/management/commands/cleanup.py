@@ -39,6 +39,10 @@ def clean_db():
     deleted = delete(models.ResourceUsage.objects.filter(measured_at__lt=delete_before))
     print(f'Deleted {deleted} resource usage measurements')
 
+    # running stats include deleted measurements, they are rebuilt from retained ones by summary tasks
+    deleted = delete(models.ContainerSummary.objects.filter(since__lt=delete_before))
+    print(f'Deleted {deleted} container summaries past retention')
+
     deleted = delete(models.Pod.objects.filter(gone_at__lt=delete_before))
     print(f'Deleted {deleted} pods')
 
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.2 on 2021-08-02 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kra', '0025_oomevent_is_ignored'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('resource_version', models.CharField(max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
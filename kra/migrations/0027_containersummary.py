@@ -0,0 +1,36 @@
+# Generated by Django 3.2.2 on 2021-08-09 14:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kra', '0026_watchstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContainerSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateTimeField()),
+                ('till', models.DateTimeField()),
+                ('total_seconds', models.FloatField()),
+                ('weight_seconds', models.FloatField()),
+                ('max_memory_mi', models.PositiveIntegerField()),
+                ('avg_memory_mi', models.FloatField()),
+                ('stddev_memory_mi', models.FloatField()),
+                ('total_memory_mi_seconds', models.FloatField()),
+                ('total_memory_mi2_seconds', models.FloatField()),
+                ('max_cpu_m', models.FloatField()),
+                ('avg_cpu_m', models.FloatField()),
+                ('stddev_cpu_m', models.FloatField()),
+                ('total_cpu_m_seconds', models.BigIntegerField()),
+                ('weighted_cpu_m_seconds', models.FloatField()),
+                ('total_cpu_m2_seconds', models.FloatField()),
+                ('container', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='kra.container')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.2 on 2021-08-11 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kra', '0027_containersummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='containersummary',
+            name='last_cpu_m_seconds',
+            field=models.BigIntegerField(default=0),
+        ),
+        # frozen summaries, cpu_m_seconds is cumulative
+        migrations.RunSQL(
+            'UPDATE kra_containersummary SET last_cpu_m_seconds = total_cpu_m_seconds',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 3.2.2 on 2021-08-12 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kra', '0028_containersummary_last_cpu_m_seconds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instancesummary',
+            name='since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='till',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='total_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='weight_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='total_memory_mi_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='total_memory_mi2_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='total_cpu_m_seconds',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='weighted_cpu_m_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='total_cpu_m2_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='till',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='total_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='weight_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='total_memory_mi_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='total_memory_mi2_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='total_cpu_m_seconds',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='weighted_cpu_m_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='total_cpu_m2_seconds',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 3.2.2 on 2021-08-13 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kra', '0029_summary_moments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='containersummary',
+            name='cpu_sketch',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='containersummary',
+            name='memory_sketch',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='cpu_sketch',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='instancesummary',
+            name='memory_sketch',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='cpu_sketch',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='memory_sketch',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='p50_cpu_m',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='p50_memory_mi',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='p90_cpu_m',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='p90_memory_mi',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='p95_cpu_m',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='p95_memory_mi',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='p99_cpu_m',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='summary',
+            name='p99_memory_mi',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
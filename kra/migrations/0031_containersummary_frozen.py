@@ -0,0 +1,18 @@
+# Generated by Django 3.2.2 on 2021-08-14 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kra', '0030_summary_sketches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='containersummary',
+            name='frozen',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.2 on 2021-08-14 11:35
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kra', '0031_containersummary_frozen'),
+    ]
+
+    operations = [
+        # summaries without sketches, they are rebuilt from retained samples, so that quantiles and moments
+        # cover the same samples
+        migrations.RunSQL(
+            'DELETE FROM kra_containersummary',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import models
+
+
+class ContainerSummary(models.Model):
+    """
+    Running resource usage stats of container, advanced incrementally by samples newer than `till`
+    and frozen once container is finished (see kra.analytics.container)
+    """
+    container = models.OneToOneField('Container', on_delete=models.CASCADE, related_name='summary')
+    frozen = models.BooleanField(default=False)  # all samples of finished container are aggregated
+
+    since = models.DateTimeField()
+    till = models.DateTimeField()  # watermark, measured_at of last aggregated sample
+    last_cpu_m_seconds = models.BigIntegerField(default=0)  # cpu_m_seconds of last aggregated sample
+    total_seconds = models.FloatField()
+    weight_seconds = models.FloatField()  # sum of sample weights
+
+    max_memory_mi = models.PositiveIntegerField()
+    avg_memory_mi = models.FloatField()
+    stddev_memory_mi = models.FloatField()
+    total_memory_mi_seconds = models.FloatField()
+    total_memory_mi2_seconds = models.FloatField()
+
+    max_cpu_m = models.FloatField()
+    avg_cpu_m = models.FloatField()
+    stddev_cpu_m = models.FloatField()
+    total_cpu_m_seconds = models.BigIntegerField()
+    weighted_cpu_m_seconds = models.FloatField()
+    total_cpu_m2_seconds = models.FloatField()
+
+    # see kra.analytics.sketch
+    memory_sketch = models.JSONField(default=dict)
+    cpu_sketch = models.JSONField(default=dict)
+
+    def __str__(self):
+        return str(self.container)
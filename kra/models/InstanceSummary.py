@@ -7,7 +7,18 @@ class InstanceSummary(models.Model):
     """
     aggregated = models.ForeignKey('Summary', on_delete=models.CASCADE)
 
-    # TODO: add since, till
+    # mergeable state, see kra.analytics.moments
+    since = models.DateTimeField(blank=True, null=True)
+    till = models.DateTimeField(blank=True, null=True)
+    total_seconds = models.FloatField(default=0)
+    weight_seconds = models.FloatField(default=0)
+    total_memory_mi_seconds = models.FloatField(default=0)
+    total_memory_mi2_seconds = models.FloatField(default=0)
+    total_cpu_m_seconds = models.BigIntegerField(default=0)
+    weighted_cpu_m_seconds = models.FloatField(default=0)
+    total_cpu_m2_seconds = models.FloatField(default=0)
+    memory_sketch = models.JSONField(default=dict)
+    cpu_sketch = models.JSONField(default=dict)
 
     max_memory_mi = models.PositiveIntegerField()
     avg_memory_mi = models.PositiveIntegerField()
@@ -9,13 +9,34 @@ class Summary(models.Model):
     max_memory_mi = models.PositiveIntegerField()
     avg_memory_mi = models.PositiveIntegerField()
     stddev_memory_mi = models.PositiveIntegerField()
+    p50_memory_mi = models.PositiveIntegerField(blank=True, null=True)
+    p90_memory_mi = models.PositiveIntegerField(blank=True, null=True)
+    p95_memory_mi = models.PositiveIntegerField(blank=True, null=True)
+    p99_memory_mi = models.PositiveIntegerField(blank=True, null=True)
     memory_limit_mi = models.PositiveIntegerField(blank=True, null=True)
 
     max_cpu_m = models.PositiveIntegerField()
     avg_cpu_m = models.PositiveIntegerField()
     stddev_cpu_m = models.PositiveIntegerField()
+    p50_cpu_m = models.PositiveIntegerField(blank=True, null=True)
+    p90_cpu_m = models.PositiveIntegerField(blank=True, null=True)
+    p95_cpu_m = models.PositiveIntegerField(blank=True, null=True)
+    p99_cpu_m = models.PositiveIntegerField(blank=True, null=True)
     cpu_request_m = models.PositiveIntegerField(blank=True, null=True)
 
+    # mergeable state, see kra.analytics.moments
+    since = models.DateTimeField(blank=True, null=True)
+    till = models.DateTimeField(blank=True, null=True)
+    total_seconds = models.FloatField(default=0)
+    weight_seconds = models.FloatField(default=0)
+    total_memory_mi_seconds = models.FloatField(default=0)
+    total_memory_mi2_seconds = models.FloatField(default=0)
+    total_cpu_m_seconds = models.BigIntegerField(default=0)
+    weighted_cpu_m_seconds = models.FloatField(default=0)
+    total_cpu_m2_seconds = models.FloatField(default=0)
+    memory_sketch = models.JSONField(default=dict)
+    cpu_sketch = models.JSONField(default=dict)
+
     class Meta:
         unique_together = ('workload', 'container_name')
 
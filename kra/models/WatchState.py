@@ -0,0 +1,10 @@
+from django.db import models
+
+
+class WatchState(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    resource_version = models.CharField(max_length=255)  # last handled, collector resumes watch from it
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
@@ -1,6 +1,7 @@
 from .Adjustment import Adjustment  # noqa
 from .Container import Container  # noqa
 from .ContainerAdjustment import ContainerAdjustment  # noqa
+from .ContainerSummary import ContainerSummary  # noqa
 from .InstanceSummary import InstanceSummary  # noqa
 from .OOMEvent import OOMEvent  # noqa
 from .OperationResult import OperationResult  # noqa
@@ -10,3 +11,4 @@ from .Suggestion import Suggestion  # noqa
 from .Summary import Summary  # noqa
 from .Workload import Workload  # noqa
 from .Workload import WorkloadKind  # noqa
+from .WatchState import WatchState  # noqa
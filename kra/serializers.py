@@ -28,10 +28,18 @@ class NestedSummarySerializer(serializers.ModelSerializer):
             'max_memory_mi',
             'avg_memory_mi',
             'stddev_memory_mi',
+            'p50_memory_mi',
+            'p90_memory_mi',
+            'p95_memory_mi',
+            'p99_memory_mi',
             'memory_limit_mi',
             'max_cpu_m',
             'avg_cpu_m',
             'stddev_cpu_m',
+            'p50_cpu_m',
+            'p90_cpu_m',
+            'p95_cpu_m',
+            'p99_cpu_m',
             'cpu_request_m',
             'suggestion',
         ]
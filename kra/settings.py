@@ -11,6 +11,27 @@ if env('DEV_ENV'):
     CORS_ALLOW_ALL_ORIGINS = True
 
 env.scheme['MAX_RETENTION_DAYS'] = (int, 30)
+env.scheme['COLLECTOR_METRICS_PORT'] = (int, None)
+env.scheme['METRICS_COLLECT_CONCURRENCY'] = (int, 16)
+env.scheme['METRICS_SCRAPE_TIMEOUT_SECONDS'] = (int, 20)
+env.scheme['METRICS_SCRAPE_MODE'] = (str, 'cadvisor')
+env.scheme['METRICS_SHARD_COUNT'] = (int, 1)
+env.scheme['METRICS_SHARD_INDEX'] = (int, None)
+env.scheme['METRICS_SHARD_LEASE_NAMESPACE'] = (str, None)
+env.scheme['METRICS_QUEUE_SIZE'] = (int, 1000)
+env.scheme['METRICS_SPOOL_DIR'] = (str, None)
+env.scheme['METRICS_SPOOL_MAX_MB'] = (int, 1024)
+env.scheme['METRICS_SPOOL_DROP_POLICY'] = (str, 'oldest')
+env.scheme['METRICS_DEADBAND'] = (bool, False)
+env.scheme['METRICS_DEADBAND_MEMORY_MI'] = (int, 1)
+env.scheme['METRICS_DEADBAND_CPU_M'] = (int, 1)
+env.scheme['METRICS_DEADBAND_MAX_SILENCE_MINUTES'] = (int, 30)
+env.scheme['POD_HANDLER_WORKERS'] = (int, 4)
+env.scheme['POD_QUEUE_SIZE'] = (int, 1000)
+env.scheme['OOM_RETRY_MAX_ATTEMPTS'] = (int, 5)
+env.scheme['WATCH_RAW_DECODING'] = (bool, True)
+env.scheme['OOM_RETRY_DELAY_SECONDS'] = (int, 15)
+env.scheme['OOM_RETRY_MAX_DELAY_SECONDS'] = (int, 300)
 
 if env('DEV_ENV'):
     env.scheme['KUBE_API_URL'] = (str, 'http://127.0.0.1:8001')
@@ -27,10 +48,45 @@ REST_FRAMEWORK['DEFAULT_PAGINATION_CLASS'] = None
 
 MAX_RETENTION = datetime.timedelta(days=env('MAX_RETENTION_DAYS'))
 
+COLLECTOR_METRICS_PORT = env('COLLECTOR_METRICS_PORT')  # if set, collectors serve prometheus /metrics
+
+METRICS_COLLECT_CONCURRENCY = env('METRICS_COLLECT_CONCURRENCY')
+METRICS_SCRAPE_TIMEOUT = datetime.timedelta(seconds=env('METRICS_SCRAPE_TIMEOUT_SECONDS'))
+METRICS_SCRAPE_MODE = env('METRICS_SCRAPE_MODE')  # cadvisor or resource
+METRICS_SHARD_COUNT = env('METRICS_SHARD_COUNT')
+METRICS_SHARD_INDEX = env('METRICS_SHARD_INDEX')  # defaults to StatefulSet pod ordinal
+METRICS_SHARD_LEASE_NAMESPACE = env('METRICS_SHARD_LEASE_NAMESPACE')  # if set, shards are balanced by leases
+METRICS_QUEUE_SIZE = env('METRICS_QUEUE_SIZE')  # in node scrapes
+METRICS_SPOOL_DIR = env('METRICS_SPOOL_DIR')  # if not set, samples are dropped when db is unavailable
+METRICS_SPOOL_MAX_BYTES = env('METRICS_SPOOL_MAX_MB') * 1024 * 1024
+METRICS_SPOOL_DROP_POLICY = env('METRICS_SPOOL_DROP_POLICY')  # oldest or newest
+
+# Skip samples with unchanged memory and cpu rate. Max silence should stay below minimal bucket step of
+# resource usage charts (see WorkloadViewSet), so that each bucket has a sample.
+METRICS_DEADBAND = env('METRICS_DEADBAND')
+METRICS_DEADBAND_MEMORY_MI = env('METRICS_DEADBAND_MEMORY_MI')
+METRICS_DEADBAND_CPU_M = env('METRICS_DEADBAND_CPU_M')
+METRICS_DEADBAND_MAX_SILENCE = datetime.timedelta(minutes=env('METRICS_DEADBAND_MAX_SILENCE_MINUTES'))
+
+# decode watched pods and nodes to compact records, instead of kubernetes.client models
+WATCH_RAW_DECODING = env('WATCH_RAW_DECODING')
+
+POD_HANDLER_WORKERS = env('POD_HANDLER_WORKERS')
+POD_QUEUE_SIZE = env('POD_QUEUE_SIZE')  # per worker, watcher waits when queue is full
+
+# OOM event is retried when its container is not yet saved by pod collector, delay doubles each attempt
+OOM_RETRY_MAX_ATTEMPTS = env('OOM_RETRY_MAX_ATTEMPTS')  # including the first one
+OOM_RETRY_DELAY = datetime.timedelta(seconds=env('OOM_RETRY_DELAY_SECONDS'))
+OOM_RETRY_MAX_DELAY = datetime.timedelta(seconds=env('OOM_RETRY_MAX_DELAY_SECONDS'))
+
+# Summary field the targets are based on, e.g. p99_memory_mi or p95_cpu_m,
+# falls back to max_memory_mi and avg_cpu_m when summary has no quantiles
+MEM_TARGET_STAT = 'max_memory_mi'
 MEM_TARGET_REQUEST = 1.1
 MEM_BOUNDS = [0.95, 1.1]
 MEM_MIN = 10
 
+CPU_TARGET_STAT = 'avg_cpu_m'
 CPU_TARGET_REQUEST = 1.0
 CPU_BOUNDS = [0.95, 1.1]
 
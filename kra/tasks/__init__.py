@@ -1,4 +1,5 @@
 from .apply_adjustment import apply_adjustment  # noqa
+from .advance_summaries import advance_summaries  # noqa
 from .make_summary import make_summary  # noqa
 from .make_summaries import make_summaries  # noqa
 from .make_suggestion import make_suggestion  # noqa
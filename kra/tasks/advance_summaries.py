@@ -0,0 +1,16 @@
+import logging
+
+from kra.celery import task
+from kra.analytics.container import advance_containers_summary
+
+log = logging.getLogger(__name__)
+
+
+@task
+def advance_summaries():
+    """
+    Advances running aggregates of containers, should be run periodically (e.g. every few minutes),
+    so that make_summary and make_summaries have little left to aggregate.
+    """
+    count = advance_containers_summary()
+    log.info('Advanced summaries of %d containers', count)
@@ -58,7 +58,8 @@ def _suggest_memory(stat, oom_events):
     reason = ''
     oom = None
 
-    target_limit = math.ceil(stat.max_memory_mi * settings.MEM_TARGET_REQUEST)
+    target_limit = math.ceil(_get_target_stat(stat, settings.MEM_TARGET_STAT, 'max_memory_mi') *
+                             settings.MEM_TARGET_REQUEST)
 
     for oom in oom_events:
         if oom.container.memory_limit_mi:
@@ -101,7 +102,7 @@ def _suggest_cpu(stat):
     priority = 0
     reason = ''
 
-    target_limit = round(stat.avg_cpu_m * settings.CPU_TARGET_REQUEST)
+    target_limit = round(_get_target_stat(stat, settings.CPU_TARGET_STAT, 'avg_cpu_m') * settings.CPU_TARGET_REQUEST)
     lower_bound = round(target_limit * settings.CPU_BOUNDS[0])
     upper_bound = round(target_limit * settings.CPU_BOUNDS[1])
 
@@ -121,6 +122,13 @@ def _suggest_cpu(stat):
     return new_request, priority, reason
 
 
+def _get_target_stat(stat, name, default_name):
+    value = getattr(stat, name)
+    if value is None:
+        value = getattr(stat, default_name)
+    return value
+
+
 def _make_fast_summary(workload_id, container_name):
     c = models.Container.objects\
         .filter(pod__workload_id=workload_id, name=container_name)\
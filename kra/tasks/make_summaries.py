@@ -6,7 +6,7 @@ from collections import defaultdict
 from utils.django.db import bulk_save
 
 from kra import models
-from kra.analytics.container import get_containers_summary
+from kra.analytics.container import summarize_containers
 from .make_summary import _fill_summary
 
 log = logging.getLogger(__name__)
@@ -26,7 +26,7 @@ def make_summaries():
     if containers_by_pod_id is None:
         log.info('Query containers summary...')
         containers_by_pod_id = defaultdict(list)
-        for c in get_containers_summary():
+        for c in summarize_containers():
             containers_by_pod_id[c.pod_id].append(c)
         if summary_dump_filename:
             with open(summary_dump_filename, 'wb') as summary_dump_file: